@@ -0,0 +1,200 @@
+import sys
+import os
+import argparse
+import json
+import random
+
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dicom_tree"))
+from dicom_tree_grow import add_template_tags
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ct_input.json")
+
+# Per series values cycled through so data/ct_filter.json keeps some series and drops others
+BODY_PARTS = ["CHEST", "ABDOMEN", "HEAD"]
+SLICE_THICKNESS = [2.5, 1.0, 5.0]
+PROCEDURE_CODES = ["CTCHCZ", "CTAPCZ", "XRCHEST"]
+ORIGINAL = ["ORIGINAL", "PRIMARY", "AXIAL"]
+DERIVED = ["DERIVED", "SECONDARY", "LOCALIZER"]
+
+PRIVATE_GROUP = 0x0029
+PRIVATE_CREATOR = "DICOM_TREE BENCHMARK"
+
+def uid(*numbers):
+    return "1.2.826.0.1.3680043.8.498."+".".join([str(n+1) for n in numbers])
+
+def add_private_tags(ds, n_private, private_size):
+    """
+    Adds private tags (OB) to a dataset, 255 to each private block.
+
+    Args:
+        ds: The dataset for one instance.
+        n_private: Number of private tags.
+        private_size: Bytes in each private tag.
+    """
+
+    value = bytes(private_size)
+    for i in range(n_private):
+        block = ds.private_block(PRIVATE_GROUP, "%s %i" % (PRIVATE_CREATOR, i // 255), create=True)
+        block.add_new(i % 255, 'OB', value)
+
+def make_instance(tag_list, study, series, number, n_instances, rows=64, n_private=0, private_size=64):
+    """
+    Creates one instance of a synthetic CT series.
+
+    Args:
+        tag_list: Template of tags (see mr_input.json).
+        study: Index of the study.
+        series: Index of the series in the study.
+        number: Index of the instance in the series.
+        n_instances: Number of instances in the series.
+        rows: Rows and columns of the image.
+        n_private: Number of private tags to add.
+        private_size: Bytes in each private tag.
+
+    Returns:
+        A pydicom Dataset with file meta information.
+    """
+
+    ds = Dataset()
+    add_template_tags(ds, tag_list, series % len(tag_list.get('Series', [None])))
+
+    ds.StudyInstanceUID = uid(study)
+    ds.SeriesInstanceUID = uid(study, series)
+    ds.SOPInstanceUID = uid(study, series, number)
+    ds.AccessionNumber = "ACC%06i" % study
+    ds.PatientID = "PT%06i" % study
+    ds.StudyID = str(study+1)
+    ds.ProcedureCodeSequence = [Dataset()]
+    ds.ProcedureCodeSequence[0].CodeValue = PROCEDURE_CODES[study % len(PROCEDURE_CODES)]
+
+    thickness = SLICE_THICKNESS[series % len(SLICE_THICKNESS)]
+    ds.SeriesNumber = series+1
+    ds.SeriesDescription = "AXIAL %.1f" % thickness
+    ds.BodyPartExamined = BODY_PARTS[series % len(BODY_PARTS)]
+    ds.ImageType = DERIVED if series % 5 == 4 else ORIGINAL
+
+    # Odd series skip an instance number half way, for contiguous_series()
+    instance_number = number+1
+    if series % 2 == 1 and number >= n_instances // 2:
+        instance_number += 1
+
+    position = [-250.0, -250.0, -thickness*instance_number]
+    ds.InstanceNumber = instance_number
+    ds.AcquisitionNumber = 1
+    ds.SliceThickness = thickness
+    ds.PixelSpacing = [0.9765625, 0.9765625]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.ImagePositionPatient = position
+    ds.SliceLocation = position[2]
+    ds.Rows = rows
+    ds.Columns = rows
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+
+    add_private_tags(ds, n_private, private_size)
+
+    ds.PixelData = bytes(rows*rows*2)
+
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    return ds
+
+def write_junk(filename, kind, rng):
+    """
+    Writes a file that is not a readable DICOM file.
+
+    Args:
+        filename: File to write.
+        kind: 'text', 'binary', 'empty' or 'truncated' (a preamble and 'DICM' followed by garbage).
+        rng: random.Random used for the file contents.
+    """
+
+    with open(filename, 'wb') as f:
+        if kind == 'text':
+            f.write(b"Not a DICOM file\n"*rng.randint(1, 100))
+        elif kind == 'binary':
+            f.write(rng.randbytes(rng.randint(16, 65536)))
+        elif kind == 'truncated':
+            f.write(bytes(128)+b"DICM"+rng.randbytes(rng.randint(0, 64)))
+
+JUNK_KINDS = ['text', 'binary', 'empty', 'truncated']
+
+def make_corpus(directory, n_studies=2, n_series=4, n_instances=50, n_private=0, private_size=64,
+        n_junk=0, rows=64, template=DEFAULT_TEMPLATE, seed=0):
+    """
+    Writes a synthetic corpus as directory/ACCnnnnnn/seriesnnn/IMnnnnnn.dcm.
+
+    Args:
+        directory: Output directory, created if needed.
+        n_studies: Number of studies.
+        n_series: Number of series in each study.
+        n_instances: Number of instances in each series.
+        n_private: Number of private tags in each instance.
+        private_size: Bytes in each private tag.
+        n_junk: Number of files that are not DICOM, spread over the study directories.
+        rows: Rows and columns of each image.
+        template: Json file of tags in the format of mr_input.json.
+        seed: Seed for the junk file contents and placement.
+
+    Returns:
+        A dict with the number of DICOM and junk files and total bytes written.
+    """
+
+    with open(template) as f:
+        tag_list = json.load(f)
+
+    rng = random.Random(seed)
+    n_files = 0
+    n_bytes = 0
+    for study in range(n_studies):
+        for series in range(n_series):
+            series_dir = os.path.join(directory, "ACC%06i" % study, "series%03i" % series)
+            os.makedirs(series_dir, exist_ok=True)
+            for number in range(n_instances):
+                ds = make_instance(tag_list, study, series, number, n_instances, rows, n_private, private_size)
+                filename = os.path.join(series_dir, "IM%06i.dcm" % number)
+                pydicom.dcmwrite(filename, ds, enforce_file_format=True)
+                n_files += 1
+                n_bytes += os.path.getsize(filename)
+
+    for i in range(n_junk):
+        junk_dir = os.path.join(directory, "ACC%06i" % rng.randrange(max(n_studies, 1)))
+        os.makedirs(junk_dir, exist_ok=True)
+        filename = os.path.join(junk_dir, "junk%06i" % i)
+        write_junk(filename, JUNK_KINDS[i % len(JUNK_KINDS)], rng)
+        n_bytes += os.path.getsize(filename)
+
+    return {"DicomFiles": n_files, "JunkFiles": n_junk, "Bytes": n_bytes}
+
+def main():
+
+    my_parser = argparse.ArgumentParser(description='Write a synthetic DICOM corpus for benchmarks')
+    my_parser.add_argument('-p', '--path', type=str, help='output directory', required=True)
+    my_parser.add_argument('-s', '--studies', type=int, help='number of studies', required=False, default=2)
+    my_parser.add_argument('-e', '--series', type=int, help='number of series in each study', required=False, default=4)
+    my_parser.add_argument('-i', '--instances', type=int, help='number of instances in each series', required=False, default=50)
+    my_parser.add_argument('--private_tags', type=int, help='number of private tags in each instance', required=False, default=0)
+    my_parser.add_argument('--private_size', type=int, help='bytes in each private tag', required=False, default=64)
+    my_parser.add_argument('-j', '--junk', type=int, help='number of files that are not DICOM', required=False, default=0)
+    my_parser.add_argument('--rows', type=int, help='rows and columns of each image', required=False, default=64)
+    my_parser.add_argument('-t', '--template', type=str, help='json file of tags (see mr_input.json)', required=False, default=DEFAULT_TEMPLATE)
+    my_parser.add_argument('--seed', type=int, help='random seed for junk files', required=False, default=0)
+    args = my_parser.parse_args()
+
+    summary = make_corpus(args.path, args.studies, args.series, args.instances, args.private_tags, args.private_size,
+        args.junk, args.rows, args.template, args.seed)
+    print("Wrote %i DICOM files and %i junk files (%.1f MB) to %s" %
+        (summary["DicomFiles"], summary["JunkFiles"], summary["Bytes"]/1e6, args.path))
+
+    return(0)
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import sys
+import os
+import argparse
+import copy
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = os.path.join(HERE, "..", "dicom_tree")
+DATA = os.path.join(HERE, "..", "data")
+
+sys.path.insert(0, TOOLS)
+from dicom_tree import DicomTree
+from tree_io import load_tree, save_tree
+from dicom_tree_prune import contiguous_series
+
+from dicom_corpus import make_corpus, DEFAULT_TEMPLATE
+from tree_io_benchmark import time_call
+
+# Instance tags used by contiguous_series(), data/ct_filter.json and data/ct_key.json
+EXTRA_INSTANCE_TAGS = [
+    {"Group": "0020", "Element": "0013", "Name": "InstanceNumber"},
+    {"Group": "0020", "Element": "1041", "Name": "SliceLocation"},
+    {"Group": "0028", "Element": "0010", "Name": "Rows"},
+    {"Group": "0028", "Element": "0011", "Name": "Columns"},
+    {"Group": "0028", "Element": "0030", "Name": "PixelSpacing"}
+]
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True)
+    except OSError:
+        return None
+    if out.returncode != 0:
+        return None
+    return out.stdout.strip()
+
+def scan(path, workers=1, comprehensive=False):
+    """
+    Scans a corpus the way dicom_tree.py does, without log output.
+
+    Returns:
+        The DicomTree after read_directory().
+    """
+
+    logger = logging.getLogger("dicom_tree_benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    dicomTree = DicomTree(path, make_logger=False)
+    dicomTree.logger = logger
+    dicomTree.workers = workers
+    dicomTree.comprehensive = comprehensive
+    dicomTree.set_default_tags()
+    dicomTree.instance_tags = dicomTree.default_instance_tags+EXTRA_INSTANCE_TAGS
+    dicomTree.read_directory(-1)
+    return dicomTree
+
+def run_tool(tool, args):
+    """
+    Runs one of the dicom_tree tools as a separate process, as it is run from the command line.
+    """
+
+    cmd = [sys.executable, os.path.join(TOOLS, tool)]+args
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def run(n_studies=2, n_series=4, n_instances=50, n_private=0, private_size=64, n_junk=0, rows=64,
+        template=DEFAULT_TEMPLATE, workers=1, comprehensive=False, repeat=3, directory=None):
+    """
+    Writes a synthetic corpus and times each scenario on it.
+
+    Returns:
+        A list of dicts with the scenario name and best time in seconds.
+    """
+
+    results = []
+    def add(scenario, seconds, **extra):
+        result = {"Scenario": scenario, "Seconds": seconds}
+        result.update(extra)
+        results.append(result)
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        corpus = os.path.join(tmpdir, "corpus")
+        summary = {}
+        seconds = time_call(lambda: summary.update(make_corpus(corpus, n_studies, n_series, n_instances,
+            n_private, private_size, n_junk, rows, template)), 1)
+        add("make_corpus", seconds, **summary)
+
+        trees = []
+        seconds = time_call(lambda: trees.append(scan(corpus, workers, comprehensive)), repeat)
+        dicomTree = trees[-1]
+        add("read_directory", seconds, Files=len(dicomTree.files), Workers=workers, Comprehensive=comprehensive,
+            FilesPerSecond=len(dicomTree.files)/seconds if seconds > 0 else 0.0, ScanStats=dicomTree.scan_stats.to_dict())
+
+        tree = {"Directory": corpus, "StudyList": dicomTree.studies}
+        tree_file = os.path.join(tmpdir, "tree.json")
+        add("save_tree", time_call(lambda: save_tree(tree, tree_file), repeat), Bytes=os.path.getsize(tree_file))
+        add("load_tree", time_call(lambda: load_tree(tree_file), repeat))
+
+        add("contiguous_series", time_call(contiguous_series, repeat, setup=lambda: copy.deepcopy(tree)))
+
+        prune_file = os.path.join(tmpdir, "pruned.json")
+        filter_file = os.path.join(DATA, "ct_filter.json")
+        add("prune", time_call(lambda: run_tool("dicom_tree_prune.py",
+            ["-t", tree_file, "-f", filter_file, "-o", prune_file]), repeat))
+
+        # Links are only made if missing, so each run links into a new directory
+        link_dirs = iter(range(repeat))
+        def link():
+            out = os.path.join(tmpdir, "links%i" % next(link_dirs))
+            run_tool("dicom_tree_link.py", ["-t", tree_file, "-o", os.path.join(out, "links"), "-s", os.path.join(out, "series")])
+        add("link", time_call(link, repeat))
+
+        csv_file = os.path.join(tmpdir, "tree.csv")
+        add("csv", time_call(lambda: run_tool("dicom_trees_to_csv.py",
+            [tree_file, "-k", os.path.join(DATA, "ct_key.json"), "-o", csv_file]), repeat))
+
+    return results
+
+def main():
+
+    my_parser = argparse.ArgumentParser(description='Time scanning, pruning, linking and exporting a synthetic DICOM corpus')
+    my_parser.add_argument('-s', '--studies', type=int, help='number of studies', required=False, default=2)
+    my_parser.add_argument('-e', '--series', type=int, help='number of series in each study', required=False, default=4)
+    my_parser.add_argument('-i', '--instances', type=int, help='number of instances in each series', required=False, default=50)
+    my_parser.add_argument('--private_tags', type=int, help='number of private tags in each instance', required=False, default=0)
+    my_parser.add_argument('--private_size', type=int, help='bytes in each private tag', required=False, default=64)
+    my_parser.add_argument('-j', '--junk', type=int, help='number of files that are not DICOM', required=False, default=0)
+    my_parser.add_argument('--rows', type=int, help='rows and columns of each image', required=False, default=64)
+    my_parser.add_argument('-t', '--template', type=str, help='json file of tags (see mr_input.json)', required=False, default=DEFAULT_TEMPLATE)
+    my_parser.add_argument('-w', '--workers', type=int, help='number of processes used to read headers', required=False, default=1)
+    my_parser.add_argument('-c', '--comprehensive', help='scan all non-private & non-pixel tags', default=False, required=False, action='store_true')
+    my_parser.add_argument('-r', '--repeat', type=int, help='number of times each step is timed (best is kept)', required=False, default=3)
+    my_parser.add_argument('-d', '--directory', type=str, help='directory for the corpus and outputs (default: system temp)', required=False, default=None)
+    my_parser.add_argument('-o', '--output', type=str, help='json file of results', required=False, default=None)
+    args = my_parser.parse_args()
+
+    results = run(args.studies, args.series, args.instances, args.private_tags, args.private_size, args.junk, args.rows,
+        args.template, args.workers, args.comprehensive, args.repeat, args.directory)
+
+    print("%-20s %10s" % ("scenario", "time (s)"))
+    for r in results:
+        print("%-20s %10.3f" % (r["Scenario"], r["Seconds"]))
+
+    if args.output is not None:
+        report = {"Commit": git_commit(), "Python": platform.python_version(),
+            "Parameters": {k: v for k, v in vars(args).items() if k != "output"}, "Results": results}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+    return(0)
+
+if __name__=="__main__":
+    sys.exit(main())
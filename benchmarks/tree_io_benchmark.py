@@ -0,0 +1,136 @@
+import sys
+import os
+import argparse
+import tempfile
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dicom_tree"))
+from tree_io import load_tree, save_tree
+
+def entry(group, element, vr, value):
+    return {"Group": group, "Element": element, "vr": vr, "Value": value}
+
+def make_instance(study, series, number):
+    """
+    Creates an instance with the kind of entries found in a comprehensive CT tree.
+    """
+
+    uid = "1.2.826.0.1.3680043.8.498.%i.%i.%i" % (study, series, number)
+    return {
+        "SOPInstanceUID": entry("0008", "0018", "UI", [uid]),
+        "Filename": "/data/dicom/ACC%06i/series%03i/IM%06i.dcm" % (study, series, number),
+        "SOPClassUID": entry("0008", "0016", "UI", ["1.2.840.10008.5.1.4.1.1.2"]),
+        "ImageType": entry("0008", "0008", "CS", ["ORIGINAL", "PRIMARY", "AXIAL"]),
+        "AcquisitionDate": entry("0008", "0022", "DA", ["20200101"]),
+        "ContentTime": entry("0008", "0033", "TM", ["101010.%06i" % number]),
+        "Modality": entry("0008", "0060", "CS", ["CT"]),
+        "Manufacturer": entry("0008", "0070", "LO", ["SIEMENS"]),
+        "PatientName": entry("0010", "0010", "PN", [{"Alphabetic": "DOE^JANE"}]),
+        "SliceThickness": entry("0018", "0050", "DS", [1.0]),
+        "KVP": entry("0018", "0060", "DS", [120]),
+        "InstanceNumber": entry("0020", "0013", "IS", [number+1]),
+        "ImagePositionPatient": entry("0020", "0032", "DS", [-250.0, -250.0, -1.25*number]),
+        "ImageOrientationPatient": entry("0020", "0037", "DS", [1, 0, 0, 0, 1, 0]),
+        "SliceLocation": entry("0020", "1041", "DS", [-1.25*number]),
+        "Rows": entry("0028", "0010", "US", [512]),
+        "Columns": entry("0028", "0011", "US", [512]),
+        "PixelSpacing": entry("0028", "0030", "DS", [0.9765625, 0.9765625]),
+        "WindowCenter": entry("0028", "1050", "DS", [40]),
+        "WindowWidth": entry("0028", "1051", "DS", [400]),
+        "RescaleIntercept": entry("0028", "1052", "DS", [-1024]),
+        "RescaleSlope": entry("0028", "1053", "DS", [1]),
+    }
+
+def make_tree(n_instances, per_series=250, series_per_study=4):
+    """
+    Creates a synthetic tree.
+
+    Args:
+        n_instances: Total number of instances.
+        per_series: Number of instances in each series.
+        series_per_study: Number of series in each study.
+
+    Returns:
+        A dict with a 'StudyList'.
+    """
+
+    studies = []
+    n = 0
+    study_idx = 0
+    while n < n_instances:
+        study = {"StudyInstanceUID": entry("0020", "000D", "UI", ["1.2.826.0.1.3680043.8.498.%i" % study_idx]),
+            "AccessionNumber": entry("0008", "0050", "SH", ["ACC%06i" % study_idx]),
+            "StudyDate": entry("0008", "0020", "DA", ["20200101"]),
+            "SeriesList": []}
+        for series_idx in range(series_per_study):
+            if n >= n_instances:
+                break
+            count = min(per_series, n_instances-n)
+            series = {"SeriesInstanceUID": entry("0020", "000E", "UI", ["1.2.826.0.1.3680043.8.498.%i.%i" % (study_idx, series_idx)]),
+                "SeriesNumber": entry("0020", "0011", "IS", [series_idx+1]),
+                "SeriesDescription": entry("0008", "103E", "LO", ["AXIAL 1.25"]),
+                "InstanceList": [make_instance(study_idx, series_idx, i) for i in range(count)]}
+            study["SeriesList"].append(series)
+            n += count
+        studies.append(study)
+        study_idx += 1
+
+    return {"Directory": "/data/dicom", "StudyList": studies}
+
+# setup() is called untimed before each call and its result passed to func
+def time_call(func, repeat, setup=None):
+    best = None
+    for i in range(repeat):
+        args = () if setup is None else (setup(),)
+        t0 = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter()-t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(n_instances, extensions, repeat=3, directory=None):
+    """
+    Times save_tree() and load_tree() for each file extension.
+
+    Returns:
+        A list of dicts with the extension, file size and best save and load times in seconds.
+    """
+
+    tree = make_tree(n_instances)
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        for ext in extensions:
+            filename = os.path.join(tmpdir, "tree"+ext)
+            save_time = time_call(lambda: save_tree(tree, filename), repeat)
+            load_time = time_call(lambda: load_tree(filename), repeat)
+            results.append({"Extension": ext, "Instances": n_instances, "Bytes": os.path.getsize(filename),
+                "SaveSeconds": save_time, "LoadSeconds": load_time})
+    return results
+
+def main():
+
+    my_parser = argparse.ArgumentParser(description='Time loading and saving trees in each file format')
+    my_parser.add_argument('-n', '--instances', type=int, help='number of instances in the tree', required=False, default=100000)
+    my_parser.add_argument('-e', '--extensions', type=str, nargs='+', help='file extensions to time', required=False,
+        default=[".json", ".ndjson", ".pkl"])
+    my_parser.add_argument('-r', '--repeat', type=int, help='number of times each step is timed (best is kept)', required=False, default=3)
+    my_parser.add_argument('-o', '--output', type=str, help='json file of results', required=False, default=None)
+    args = my_parser.parse_args()
+
+    results = run(args.instances, args.extensions, args.repeat)
+
+    base = results[0]["LoadSeconds"]
+    print("%-10s %12s %10s %10s %8s" % ("format", "MB", "save (s)", "load (s)", "load x"))
+    for r in results:
+        print("%-10s %12.1f %10.3f %10.3f %8.2f" % (r["Extension"], r["Bytes"]/1e6, r["SaveSeconds"], r["LoadSeconds"], base/r["LoadSeconds"]))
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+    return(0)
+
+if __name__=="__main__":
+    sys.exit(main())
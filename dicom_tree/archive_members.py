@@ -0,0 +1,181 @@
+import os
+import shutil
+import tarfile
+import zipfile
+
+# Files inside zip and tar archives are scanned without extracting them.
+# A member is named by the archive path, MEMBER_SEP and its path in the
+# archive, e.g. '/data/export.zip!/ACC001/IM0001.dcm'. These names are
+# kept in 'Filename' so the file can be read or extracted later, and
+# os.path.basename() of a name is the basename of the member.
+
+MEMBER_SEP = "!/"
+
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def is_archive(path):
+    name = path.lower()
+    return name.endswith(ZIP_EXTENSIONS) or name.endswith(TAR_EXTENSIONS)
+
+def is_zip(path):
+    return path.lower().endswith(ZIP_EXTENSIONS)
+
+def member_name(archive, member):
+    return archive+MEMBER_SEP+member.lstrip("/")
+
+def split_member(filename):
+    """
+    Splits a member name into the archive path and the path in the archive.
+
+    Args:
+        filename: A file or member name.
+
+    Returns:
+        (archive, member), or (filename, None) if filename is not in an archive.
+    """
+
+    start = 0
+    while True:
+        pos = filename.find(MEMBER_SEP, start)
+        if pos < 0:
+            return (filename, None)
+        if is_archive(filename[:pos]):
+            return (filename[:pos], filename[pos+len(MEMBER_SEP):])
+        start = pos+1
+
+def is_member(filename):
+    return split_member(filename)[1] is not None
+
+def iter_members(archive, head_size):
+    """
+    Reads the regular files of an archive in the order they are stored, so a
+    compressed tar is only decompressed once.
+
+    Args:
+        archive: Path of a zip or tar file.
+        head_size: Bytes to read from the start of each member.
+
+    Yields:
+        (name, head) with the member name (see member_name()) and its first head_size bytes.
+    """
+
+    if is_zip(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info) as fp:
+                    yield (member_name(archive, info.filename), fp.read(head_size))
+        return
+
+    with tarfile.open(archive, 'r|*') as tf:
+        for info in tf:
+            if not info.isfile():
+                continue
+            fp = tf.extractfile(info)
+            yield (member_name(archive, info.name), fp.read(head_size))
+
+class MemberFile:
+    """
+    Read-only file object for one archive member, closing the archive with it.
+    Members of compressed archives are decompressed from the start on each
+    open and on seeking backwards, so this is for reads past a member's head.
+    """
+
+    def __init__(self, filename):
+        archive, member = split_member(filename)
+        self.name = filename
+        if is_zip(archive):
+            self._archive = zipfile.ZipFile(archive)
+            self._fp = self._archive.open(member)
+        else:
+            self._archive = tarfile.open(archive, 'r:*')
+            try:
+                self._fp = self._archive.extractfile(member)
+            except KeyError:
+                self._fp = None
+            if self._fp is None:
+                self._archive.close()
+                raise FileNotFoundError("No regular file %s in %s" % (member, archive))
+
+    def read(self, size=-1):
+        return self._fp.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._fp.seek(offset, whence)
+
+    def tell(self):
+        return self._fp.tell()
+
+    def close(self):
+        self._fp.close()
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_file(filename):
+    """
+    Opens a file or archive member for binary reading.
+    """
+
+    if is_member(filename):
+        return MemberFile(filename)
+    return open(filename, 'rb')
+
+def file_stat(filename):
+    """
+    Gets (size, mtime in ns) of a file. A member has those of its archive, so it is seen as changed when the archive is.
+    """
+
+    st = os.stat(split_member(filename)[0])
+    return (st.st_size, st.st_mtime_ns)
+
+def extract_members(targets):
+    """
+    Copies archive members to files, reading each archive once.
+
+    Args:
+        targets: A list of (member name, output file).
+
+    Returns:
+        The number of files written.
+    """
+
+    by_archive = {}
+    for filename, oname in targets:
+        archive, member = split_member(filename)
+        by_archive.setdefault(archive, {}).setdefault(member, []).append(oname)
+
+    n_written = 0
+    for archive, members in by_archive.items():
+        if is_zip(archive):
+            with zipfile.ZipFile(archive) as zf:
+                for member, onames in members.items():
+                    with zf.open(member) as src, open(onames[0], 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    for oname in onames[1:]:
+                        shutil.copyfile(onames[0], oname)
+                    n_written += len(onames)
+            continue
+
+        with tarfile.open(archive, 'r|*') as tf:
+            for info in tf:
+                onames = members.pop(info.name.lstrip("/"), None)
+                if onames is None or not info.isfile():
+                    continue
+                with open(onames[0], 'wb') as dst:
+                    shutil.copyfileobj(tf.extractfile(info), dst)
+                for oname in onames[1:]:
+                    shutil.copyfile(onames[0], oname)
+                n_written += len(onames)
+                if len(members)==0:
+                    break
+
+        if len(members) > 0:
+            raise FileNotFoundError("No regular file %s in %s" % (next(iter(members)), archive))
+    return n_written
@@ -12,6 +12,33 @@ from pydicom.uid import generate_uid
 from datetime import datetime
 import logging
 import json
+import copy
+import time
+import collections
+import functools
+import zlib
+import threading
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from .tree_io import is_ndjson, ndjson_record, write_ndjson_record, save_tree, replace_tree, open_tree_file
+    from .tree_index import write_index
+    from .tree_json import dump, dumps_line
+    from .instance_columns import InstanceColumns, select_rows
+    from .series_common import hoist_tree, hoisted_copy, series_first_values
+    from .archive_members import is_archive, iter_members, open_file, file_stat
+    from .tree_watch import FileWatcher
+    from .tree_filter import compile_filter
+except ImportError:
+    from tree_io import is_ndjson, ndjson_record, write_ndjson_record, save_tree, replace_tree, open_tree_file
+    from tree_index import write_index
+    from tree_json import dump, dumps_line
+    from instance_columns import InstanceColumns, select_rows
+    from series_common import hoist_tree, hoisted_copy, series_first_values
+    from archive_members import is_archive, iter_members, open_file, file_stat
+    from tree_watch import FileWatcher
+    from tree_filter import compile_filter
 
 def longest_identical_sequence_indices(lst, tolerance=None):
     """Finds the indices of the longest sequence of identical values in a list.
@@ -123,21 +150,250 @@ def longest_consecutive_sequences(nums, first=False):
     return longest_chains
 
 
-def list_files(path, levels=2):
-    file_list = [f.path for f in os.scandir(path) if f.is_file()]
-    if levels > 1:
-        for d in list_dirs(path, levels=levels-1):
-            file_list.extend(list_files(d, levels=1))
+def walk_files(path, depth=1):
+    """
+    Finds the files in a directory tree, breadth first.
+
+    Args:
+        path: The top level directory.
+        depth: How many levels of subdirectories to search, a negative value searches all levels.
+
+    Yields:
+        The path of each file, as it is found. Files in a directory come before files in its subdirectories.
+    """
+
+    visited = set()
+    queue = collections.deque([(path, 0)])
+    while queue:
+        dirname, level = queue.popleft()
+
+        # Symlinks can lead back to a directory that was already searched
+        st = os.stat(dirname)
+        if (st.st_dev, st.st_ino) in visited:
+            continue
+        visited.add((st.st_dev, st.st_ino))
+
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.path
+                elif entry.is_dir() and (depth < 0 or level < depth):
+                    queue.append((entry.path, level+1))
+
+def parse_shard(text):
+    """
+    Parses a shard given as 'i/N', used as an argparse type.
+
+    Args:
+        text: The shard index and count, with 0 <= i < N.
+
+    Returns:
+        The tuple (i, N).
+    """
+
+    try:
+        index, count = [int(x) for x in text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be given as i/N: %s" % text)
+
+    if count < 1 or index < 0 or index >= count:
+        raise argparse.ArgumentTypeError("shard index must be in 0..N-1: %s" % text)
+    return (index, count)
+
+# Shard of a file, from a hash of its path below the scanned directory so
+# every job with the same directory and shard count agrees
+def shard_of(relpath, count):
+    return zlib.crc32(relpath.encode('utf-8', 'surrogateescape')) % count
+
+# Files that could not be read are skipped with READ_ERROR and the exception
+# type. The error may not happen again (e.g. a stale NFS handle), so unlike
+# other skips these are never kept in the manifest
+READ_ERROR = "read error "
+
+def is_read_error(reason):
+    return reason is not None and reason.startswith(READ_ERROR)
+
+def read_ahead(items, read, depth):
+    """
+    Calls read() on upcoming items in a pool of threads, so slow opens and first reads overlap.
+
+    Args:
+        items: An iterable of items, consumed as the results are taken.
+        read: A function of one item, it should not raise.
+        depth: Number of reads kept in flight.
+
+    Yields:
+        (item, read(item)) in the order of items.
+    """
+
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, pool.submit(read, item)))
+            if len(pending) >= depth:
+                item, future = pending.popleft()
+                yield (item, future.result())
+        while pending:
+            item, future = pending.popleft()
+            yield (item, future.result())
+
+class HeadFile:
+    """
+    Read-only file object for a file whose first bytes are already in memory.
+    Reads are served from the buffer and the file itself is only opened if
+    the parser goes past the end of the buffer.
+    """
+
+    def __init__(self, filename, head, complete):
+        self.name = filename
+        self.head = head
+        self.complete = complete    # head is the whole file
+        self.bytes_read = len(head)
+        self._pos = 0
+        self._fp = None
+
+    def _file(self):
+        if self._fp is None:
+            self._fp = open_file(self.name)
+        return self._fp
+
+    def read(self, size=-1):
+        n_head = len(self.head)
+        if size is None or size < 0:
+            end = None
+        else:
+            end = self._pos+size
+
+        if self.complete or (end is not None and end <= n_head):
+            data = self.head[self._pos:end]
+            self._pos += len(data)
+            return data
+
+        data = self.head[self._pos:]
+        fp = self._file()
+        fp.seek(max(self._pos, n_head))
+        rest = fp.read(-1 if end is None else end-max(self._pos, n_head))
+        self.bytes_read += len(rest)
+        self._pos = max(self._pos, n_head)+len(rest)
+        return data+rest
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif self.complete:
+            self._pos = len(self.head)+offset
+        else:
+            self._pos = self._file().seek(offset, 2)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
-    return file_list
+class ScanStats:
+    """
+    Cumulative seconds spent in each phase of a scan and counts of the files
+    and bytes read. Each phase costs two calls to time.perf_counter() per
+    file, which is small next to reading the file, so the stats are always on.
+    With scan workers or read-ahead threads, phase times are summed over the
+    processes and threads and can add up to more than the scan time.
+    """
+
+    # list: finding files, sniff: checking for the DICM marker, read_ahead: reading
+    # heads in threads, parse: pydicom, json: to_json_dict, insert: adding to the tree
+    PHASES = ("list", "sniff", "read_ahead", "parse", "json", "insert")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.scan_seconds = 0.0         # wall time of read_directory()
+        self.files_listed = 0           # files found, before any shard is taken
+        self.files_read = 0             # files given to the parser
+        self.files_cached = 0           # files whose scan was reused from the manifest
+        self.bytes_read = 0
+        self.instances_inserted = 0
+        self.duplicates = 0             # instances already in the tree
+        self.failures = collections.Counter()   # parser errors by exception type
+        self._lock = threading.Lock()   # for phases timed in read-ahead threads
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.seconds[phase] += seconds
+
+    # Add the stats of a scan worker, as returned by to_dict()
+    def add(self, stats):
+        for phase, seconds in stats["Seconds"].items():
+            self.seconds[phase] += seconds
+        self.files_read += stats["FilesRead"]
+        self.files_cached += stats["FilesCached"]
+        self.bytes_read += stats["BytesRead"]
+        self.failures.update(stats["Failures"])
+
+    def to_dict(self):
+        return {"ScanSeconds": self.scan_seconds, "Seconds": dict(self.seconds),
+            "FilesListed": self.files_listed, "FilesRead": self.files_read, "FilesCached": self.files_cached,
+            "BytesRead": self.bytes_read, "InstancesInserted": self.instances_inserted,
+            "Duplicates": self.duplicates, "Failures": dict(self.failures)}
+
+# Per-process tree used by scan workers, set up once by _init_scan_worker()
+_scan_tree = None
+
+def _init_scan_worker(settings):
+    global _scan_tree
+    _scan_tree = DicomTree(make_logger=False)
+    _scan_tree.logger = logging.getLogger("dicom_tree")
+    for key, value in settings.items():
+        setattr(_scan_tree, key, value)
+    _scan_tree.get_tag_dicts()
+
+def _scan_worker(items):
+    _scan_tree.scan_stats = ScanStats()
+    results = list(_scan_tree.try_scan_files(items))
+    return (results, _scan_tree.scan_stats.to_dict())
+
+# Tag key and entry for comprehensive scans, computed once per tag in each process
+@functools.lru_cache(maxsize=None)
+def comprehensive_tag_entry(tag):
+    name = ""
+    if pydicom.datadict.dictionary_has_tag(tag):
+        name = pydicom.datadict.dictionary_keyword(tag)
+    key = f"{tag:>08X}"
+    return (key, {"Name": name, "Group": key[0:4], "Element": key[4:8]})
+
+def looks_like_headerless_dicom(head):
+    """
+    Checks if the start of a file looks like a DICOM dataset without the 128 byte preamble and 'DICM' marker.
+
+    Args:
+        head: The first bytes of the file.
+
+    Returns:
+        True if the file starts with a little endian group 0002 or 0008 element with a plausible length.
+    """
+
+    if len(head) < 8:
+        return False
 
-def list_dirs(path, levels=2):
-    dir_list = [d.path for d in os.scandir(path) if d.is_dir()]
-    if levels > 1:
-        for d in dir_list:
-            dir_list.extend(list_dirs(d, levels=levels-1))
+    group = int.from_bytes(head[0:2], 'little')
+    if group not in (0x0002, 0x0008):
+        return False
 
-    return dir_list
+    # explicit VR, or an implicit VR 32-bit length that is not absurd
+    if head[4:6].isalpha() and head[4:6].isupper():
+        return True
+    length = int.from_bytes(head[4:8], 'little')
+    return length < 0x10000
 
 class DicomTree:
 
@@ -150,13 +406,39 @@ class DicomTree:
         self.instance_tags = []     # list of instance level tags to extract
 
         self.comprehensive = False  # Use as many tags as possible
+        self.workers = 1            # number of processes used to read headers
+        self.targeted = False       # only parse the tags that will be kept
+        self.manifest = None        # json file of cached scans, keyed by filename, size and mtime
+        self.headerless = False     # also read files without a preamble that look like DICOM
+        self.skipped = collections.Counter()    # number of files skipped, by reason
+        self.stream = None          # open ndjson file, instances are written here instead of kept in self.studies
+        self.compact = False        # write json without indentation or spaces
+        self.columnar = False       # store each series' instances as InstanceColumns to save memory
+        self.read_ahead = 0         # number of files read into memory ahead of the parser, 0 to read directly
+        self.read_ahead_size = 65536    # bytes read ahead for each file, longer headers are read from the file
+        self.shard = None           # (index, count) to only scan the files in one shard
+        self.archives = False       # also scan inside zip and tar files found in the directory
+        self.filter = None          # checks of study, series and instance tags (see tree_filter.py), failing files are not added
+        self.scan_stats = ScanStats()   # phase times and counters of the last read_directory()
 
         self._study_dict = None
         self._series_dict = None
         self._instance_dict = None
+        self._read_tags = None      # tags to parse when self.targeted is set
+        self._filter_checks = None  # self.filter compiled by get_tag_dicts()
+        self._filter_studies = {}   # StudyInstanceUID -> passed the Study checks of self.filter
+        self._filter_series = {}    # (study, series) UIDs -> passed the Series checks of self.filter
+        self._rejected = set()      # study UIDs and (study, series) UIDs that failed self.filter
 
         self.studies = []           # list of studies (dicts) found in the files
 
+        # UID lookups into self.studies, kept in sync as instances are added
+        self.study_index = {}       # StudyInstanceUID -> study
+        self.series_index = {}      # SeriesInstanceUID -> series
+        self.instance_index = {}    # SOPInstanceUID -> instance
+        self._node_index = {}       # (study,) (study,series) (study,series,instance) UIDs -> node
+        self._series_study = {}     # SeriesInstanceUID -> StudyInstanceUID, for the series in series_index
+
         self._instance_code = {"Group":"0008", "Element": "0018", "Name": "SOPInstanceUID"}
         self._series_code = {"Group": "0020", "Element": "000E", "Name": "SeriesInstanceUID"}
         self._study_code = {"Group": "0020", "Element": "000D", "Name": "StudyInstanceUID"}
@@ -235,6 +517,25 @@ class DicomTree:
         self._study_dict = self.tag_list_to_dict(self.study_tags)
         self._series_dict = self.tag_list_to_dict(self.series_tags)
         self._instance_dict = self.tag_list_to_dict(self.instance_tags)
+        if self.comprehensive:
+            self._instance_dict = {}    # grows to all tags found, see register_tags()
+        self._read_tags = self.get_read_tags()
+        self._filter_checks = compile_filter(self.filter) if self.filter is not None else None
+
+    # All tags needed to build the tree, sorted so reads can stop after the last one
+    def get_read_tags(self):
+        keys = set([self._study_code_key, self._series_code_key, self._instance_code_key])
+        keys.update(self._study_dict.keys())
+        keys.update(self._series_dict.keys())
+        keys.update(self._instance_dict.keys())
+        return sorted([int(k,16) for k in keys])
+
+    # Settings copied to each scan worker process
+    def scan_settings(self):
+        return {"study_tags": self.study_tags, "series_tags": self.series_tags,
+            "instance_tags": self.instance_tags, "comprehensive": self.comprehensive,
+            "targeted": self.targeted, "headerless": self.headerless,
+            "read_ahead": self.read_ahead, "read_ahead_size": self.read_ahead_size, "filter": self.filter}
 
     def set_default_tags(self):
         self.set_default_study_tags()
@@ -250,14 +551,27 @@ class DicomTree:
     def set_default_instance_tags(self):
         self.instance_tags = self.default_instance_tags
 
+    # The value is copied (with the items of a sequence), so entries of a study or series never share it with an instance
     def get_entry(self, tag, value):
         val=None
         if "Value" in value:
             val = value["Value"]
+            if value["vr"]=="SQ":
+                val = copy.deepcopy(val)
+            elif isinstance(val, list):
+                val = list(val)
         dat = {"Group": tag["Group"], "Element": tag["Element"], "vr": value["vr"], "Value": val}
         entry = { tag["Name"]:  dat }
         return entry
 
+    # The UID entry and the entries of tag_dict found in js, for a study or series
+    def level_entries(self, code, code_key, tag_dict, js):
+        entries = self.get_entry(code, js[code_key])
+        for key in tag_dict.keys():
+            if key in js:
+                entries.update(self.get_entry(tag_dict[key], js[key]))
+        return entries
+
     def create_instance(self, js, filename=None):
         #self.logger.info("DicomTree.create_instance("+str(filename)+")")
         if self._instance_code_key not in js:
@@ -289,14 +603,12 @@ class DicomTree:
             dat[self._series_code_key] = series_uid_dat
         
         instance = self.create_instance(dat, filename=filename)
-        series = self.get_entry(self._series_code, dat[self._series_code_key])
-        
-        # Get series level entries
-        for key in self._series_dict.keys():
-            if key in dat:
-                series.update(self.get_entry(self._series_dict[key], dat[key]))
+        series = self.level_entries(self._series_code, self._series_code_key, self._series_dict, dat)
 
-        series.update({"InstanceList": [instance]})
+        if self.columnar:
+            series.update({"InstanceList": InstanceColumns.from_instances([instance])})
+        else:
+            series.update({"InstanceList": [instance]})
         return series
 
     def create_study(self, js, filename=None):
@@ -304,50 +616,98 @@ class DicomTree:
         self.logger.debug("DicomTree.create_study()")
  
         series = self.create_series(js, filename)
-        study = self.get_entry( self._study_code, js[self._study_code_key] )
-
-        for tag in self._study_dict.keys():
-            if tag in js:
-                study.update(self.get_entry(self._study_dict[tag], js[tag]))
+        study = self.level_entries(self._study_code, self._study_code_key, self._study_dict, js)
         study.update({"SeriesList": [series]})
 
         return study
 
     def study_exists(self, study_uid):
-        for study in self.studies:
-            if study_uid == study[self._study_code['Name']]['Value'][0]:
-                return True
-        return False
+        return study_uid in self.study_index
     
     def get_study(self, study_uid):
+        return self.study_index.get(study_uid)
+
+    def find_study(self, study_uid):
+        return self.study_index.get(study_uid)
+
+    def find_series(self, series_uid):
+        return self.series_index.get(series_uid)
+
+    # For a columnar series this returns a copy of the instance, not the stored entries
+    def find_instance(self, instance_uid):
+        instance = self.instance_index.get(instance_uid)
+        if isinstance(instance, tuple):
+            series, row = instance
+            return series["InstanceList"][row]
+        return instance
+
+    def index_instance(self, study_uid, series_uid, instance, series=None, row=None):
+        instance_uid = instance[self._instance_code['Name']]['Value'][0]
+
+        # Columnar series do not keep instance dicts, so index the row instead
+        node = instance
+        if series is not None and isinstance(series["InstanceList"], InstanceColumns):
+            node = (series, row)
+
+        self._node_index.setdefault((study_uid, series_uid, instance_uid), node)
+        self.instance_index.setdefault(instance_uid, node)
+
+    def index_series(self, study_uid, series):
+        series_uid = series[self._series_code['Name']]['Value'][0]
+        self._node_index.setdefault((study_uid, series_uid), series)
+        self.series_index.setdefault(series_uid, series)
+        self._series_study.setdefault(series_uid, study_uid)
+        for row, instance in enumerate(series["InstanceList"]):
+            self.index_instance(study_uid, series_uid, instance, series, row)
+
+    def index_study(self, study):
+        study_uid = study[self._study_code['Name']]['Value'][0]
+        self._node_index.setdefault((study_uid,), study)
+        self.study_index.setdefault(study_uid, study)
+        for series in study["SeriesList"]:
+            self.index_series(study_uid, series)
+
+    # Rebuild all UID lookups, needed after self.studies is modified directly
+    def build_index(self):
+        self.study_index = {}
+        self.series_index = {}
+        self.instance_index = {}
+        self._node_index = {}
+        self._series_study = {}
         for study in self.studies:
-            if study_uid == study[self._study_code['Name']]['Value'][0]:
-                return study
-        return None
+            self.index_study(study)
 
+    # The lookups below use the UID index when the study or series given is the
+    # indexed one, and otherwise search its list
     def is_series_in_study(self, study, series_uid):
-        for series in study["SeriesList"]:
-            if series_uid == series[self._series_code['Name']]['Value'][0]:
-                return True
-        return False
+        return self.get_series_from_study(study, series_uid) is not None
 
     def get_series_from_study(self, study, series_uid):
+        study_uid = study[self._study_code['Name']]['Value'][0]
+        if self._node_index.get((study_uid,)) is study:
+            return self._node_index.get((study_uid, series_uid))
+
         for series in study["SeriesList"]:
             if series_uid == series[self._series_code['Name']]['Value'][0]:
                 return series
         return None
-    
+
+    # For a columnar series this returns a copy of the instance, not the stored entries
     def get_instance_from_series(self, series, instance_uid):
+        series_uid = series[self._series_code['Name']]['Value'][0]
+        if self.series_index.get(series_uid) is series:
+            node = self._node_index.get((self._series_study[series_uid], series_uid, instance_uid))
+            if isinstance(node, tuple):
+                return series["InstanceList"][node[1]]
+            return node
+
         for instance in series["InstanceList"]:
             if instance_uid == instance[self._instance_code['Name']]['Value'][0]:
                 return instance
         return None
 
     def is_instance_in_series(self, series, instance_uid):
-        for instance in series["InstanceList"]:
-            if instance_uid == instance[self._instance_code['Name']]['Value'][0]:
-                return True
-        return False
+        return self.get_instance_from_series(series, instance_uid) is not None
 
     def fix_empty_PN(self, ds):
         for de in ds:
@@ -365,93 +725,716 @@ class DicomTree:
                     ds[de.tag] = de                
                          
 
-    def add_instance(self, filename, ds):
-
-        js=None
+    # Convert only the elements that will be kept, giving the same entries as ds.to_json_dict()
+    def extract_json(self, ds):
+        js={}
         try:
-            js = ds.to_json_dict()
+            for tag in self._read_tags:
+                if tag in ds:
+                    js[f"{tag:08X}"] = ds[tag].to_json_dict(None, 1024)
         except:
             self.fix_empty_PN(ds)
-            js = ds.to_json_dict()
-            return
+            return None
+
+        return js
+
+    def dataset_to_json(self, ds):
+
+        if not self.comprehensive:
+            return self.extract_json(ds)
 
         # Use all non-private tags
-        if self.comprehensive:
-            instance_dict={}
+        js={}
+        try:
             for elem in ds:
                 if not elem.is_private:
-                    tag=elem.tag
-                    key=f"{tag:>08X}"
-                    value={"Name": elem.keyword, "Group": f"{tag.group:>04X}", "Element": f"{tag.element:>04X}"}
-                    instance_dict[key]=value
+                    key = comprehensive_tag_entry(elem.tag)[0]
+                    js[key] = elem.to_json_dict(None, 1024)
+        except:
+            self.fix_empty_PN(ds)
+            return None
 
-            self._instance_dict = instance_dict
+        return js
+
+    # Add any new tags in js to the comprehensive instance dict. The dict is
+    # kept in tag order, so each instance lists its own tags in file order
+    def register_tags(self, js):
+        new_keys = [key for key in js if key not in self._instance_dict]
+        if len(new_keys)==0:
+            return
+
+        instance_dict = dict(self._instance_dict)
+        for key in new_keys:
+            instance_dict[key] = comprehensive_tag_entry(int(key,16))[1]
+        self._instance_dict = dict(sorted(instance_dict.items()))
+
+    def add_instance(self, filename, ds):
+
+        js = self.dataset_to_json(ds)
+        if js is None:
+            return
+
+        self.add_instance_json(filename, js)
+
+    def add_instance_json(self, filename, js):
 
         instance_study_uid = js[self._study_code_key]['Value'][0]
         instance_series_uid = js[self._series_code_key]['Value'][0]
         instance_instance_uid = js[self._instance_code_key]['Value'][0]
 
-        #self.logger.info("File has study UID: %s" % instance_study_uid)
-        #print(js["0020000D"])
+        if self.comprehensive:
+            self.register_tags(js)
+
+        if self.stream is not None:
+            self.stream_instance_json(filename, js, instance_study_uid, instance_series_uid, instance_instance_uid)
+            return
+
         # Create new study if it doesn't exist
-        study = self.get_study(instance_study_uid)
+        study = self._node_index.get((instance_study_uid,))
         if study is None:
             self.logger.debug("Adding new study")
             study = self.create_study(js, filename)
-            self.logger.debug("Adding new series")
             self.studies.append(study)
+            self.index_study(study)
+            self.scan_stats.instances_inserted += 1
+            return
 
-        series = self.get_series_from_study(study, instance_series_uid)
+        series = self._node_index.get((instance_study_uid, instance_series_uid))
         if series is None:
             self.logger.debug("Adding new series")
             series = self.create_series(js, filename)
             study['SeriesList'].append(series)
+            self.index_series(instance_study_uid, series)
+            self.scan_stats.instances_inserted += 1
+            return
 
-        instance = self.get_instance_from_series(series, instance_instance_uid)
-        if instance is None:
-            #self.logger.info("Adding new instance: %s" % instance_instance_uid)
+        instance_key = (instance_study_uid, instance_series_uid, instance_instance_uid)
+        if instance_key not in self._node_index:
             instance = self.create_instance(js, filename)
             series['InstanceList'].append(instance)
+            self.index_instance(instance_study_uid, instance_series_uid, instance, series, len(series['InstanceList'])-1)
+            self.scan_stats.instances_inserted += 1
+        else:
+            self.scan_stats.duplicates += 1
+
+    # Write the instance as an ndjson record instead of adding it to self.studies.
+    # Only the UIDs are kept, to skip instances that were already written
+    def stream_instance_json(self, filename, js, study_uid, series_uid, instance_uid):
+
+        study=None
+        series=None
+        if (study_uid,) not in self._node_index:
+            study = self.create_study(js, filename)
+            series = study.pop('SeriesList')[0]
+        elif (study_uid, series_uid) not in self._node_index:
+            series = self.create_series(js, filename)
+        elif (study_uid, series_uid, instance_uid) in self._node_index:
+            self.scan_stats.duplicates += 1
+            return
+
+        if series is None:
+            instance = self.create_instance(js, filename)
+        else:
+            instance = series.pop('InstanceList')[0]
+
+        self._node_index[(study_uid,)] = True
+        self._node_index[(study_uid, series_uid)] = True
+        self._node_index[(study_uid, series_uid, instance_uid)] = True
+
+        write_ndjson_record(self.stream, ndjson_record(study_uid, series_uid, study, series, instance))
+        self.scan_stats.instances_inserted += 1
+
+    # Write instances to an open file as they are read, see tree_io.py for the format
+    def stream_to(self, f):
+        self.stream = f
+        write_ndjson_record(self.stream, {"Directory": self.directory})
+
+    # Cheap check of the first 132 bytes before a full parse. Returns None if
+    # the file looks like DICOM, otherwise the reason to skip it. Without a
+    # head the bytes are read from fp, or from the file if fp is None
+    def sniff_file(self, filename, head=None, fp=None):
+        if head is None:
+            if fp is None:
+                with open_file(filename) as f:
+                    head = f.read(132)
+            else:
+                head = fp.read(132)
+        else:
+            head = head[:132]
+
+        if len(head)==132 and head[128:132]==b'DICM':
+            return None
+
+        if self.headerless and looks_like_headerless_dicom(head):
+            return None
+
+        if len(head) < 132:
+            return "too short"
+        return "no DICM marker"
+
+    # Parse only self._read_tags and stop once past the last of them
+    def read_file_targeted(self, filename):
+        with open_file(filename) as fp:
+            return self.read_partial(fp)
+
+    def read_partial(self, fp):
+        last_tag = self._read_tags[-1]
+        return pydicom.filereader.read_partial(fp, stop_when=lambda tag, vr, length: tag > last_tag,
+            force=self.headerless, specific_tags=self._read_tags)
+
+    # If head holds the first bytes of the file, parse from memory. Otherwise
+    # parse from fp, an open file that is read from the start and left open
+    def read_file(self, filename, head=None, fp=None):
+        targeted = self.targeted and not self.comprehensive
+
+        if head is not None:
+            source = HeadFile(filename, head, len(head) < self.read_ahead_size)
+        elif fp is not None:
+            fp.seek(0)
+            source = fp
+        else:
+            source = open_file(filename)
+
+        try:
+            if targeted:
+                ds = self.read_partial(source)
+            else:
+                ds = pydicom.dcmread(source,stop_before_pixels=True,force=self.headerless)
+
+            if head is not None:
+                self.scan_stats.bytes_read += source.bytes_read
+            else:
+                self.scan_stats.bytes_read += source.tell()
+        finally:
+            if source is not fp:
+                source.close()
+        return ds
+
+    # First self.read_ahead_size bytes of a file, or None to leave errors to the parser
+    def read_head(self, filename):
+        t0 = time.perf_counter()
+        try:
+            with open_file(filename) as fp:
+                return fp.read(self.read_ahead_size)
+        except OSError:
+            return None
+        finally:
+            self.scan_stats.add_time("read_ahead", time.perf_counter()-t0)
 
+    # Read one file and keep only the entries needed to place it in the tree.
+    # Returns (js, instance_dict) or None, small enough to send between processes
+    def scan_file(self, filename):
+        return self.try_scan_file(filename)[0]
 
-        #if not self.is_instance_in_series(series, js[self._instance_code_key]['Value'][0]):
-        #    logging.info("Adding new instance: %s" % js[self._instance_code_key]['Value'][0])
-        #    series['InstanceList'].append(instance)
+    # Same as scan_file() but returns (scan, reason), where reason says why a file was skipped.
+    # Without a head the file is opened once, for both the sniff and the parse
+    def try_scan_file(self, filename, head=None):
+        if head is not None:
+            return self._try_scan_file(filename, head, None)
 
+        t0 = time.perf_counter()
+        try:
+            fp = open_file(filename)
+        except Exception as e:
+            self.scan_stats.failures[type(e).__name__] += 1
+            return (None, READ_ERROR+type(e).__name__)
+        finally:
+            self.scan_stats.seconds["sniff"] += time.perf_counter()-t0
+
+        with fp:
+            return self._try_scan_file(filename, None, fp)
+
+    def _try_scan_file(self, filename, head, fp):
+        stats = self.scan_stats
+        t0 = time.perf_counter()
+        try:
+            reason = self.sniff_file(filename, head, fp)
+        except Exception as e:
+            stats.failures[type(e).__name__] += 1
+            return (None, READ_ERROR+type(e).__name__)
+        finally:
+            t1 = time.perf_counter()
+            stats.seconds["sniff"] += t1-t0
+
+        # The bytes of a parsed file are counted by read_file()
+        if reason is not None:
+            if fp is not None:
+                stats.bytes_read += fp.tell()
+            return (None, reason)
+
+        stats.files_read += 1
+        try:
+            ds = self.read_file(filename, head, fp)
+        except Exception as e:
+            stats.failures[type(e).__name__] += 1
+            return (None, READ_ERROR+type(e).__name__)
+        finally:
+            t2 = time.perf_counter()
+            stats.seconds["parse"] += t2-t1
+
+        if len(self._rejected) > 0:
+            reason = self.rejected_reason(ds)
+            if reason is not None:
+                return (None, reason)
+
+        js = self.dataset_to_json(ds)
+        stats.seconds["json"] += time.perf_counter()-t2
+        if js is None:
+            return (None, "json conversion error")
+
+        for code, key in [(self._study_code, self._study_code_key), (self._series_code, self._series_code_key),
+            (self._instance_code, self._instance_code_key)]:
+            if not js.get(key, {}).get('Value'):
+                return (None, "missing "+code["Name"])
+
+        # Comprehensive scans already hold only the non-private tags
+        if not self.comprehensive:
+            keys = [self._study_code_key, self._series_code_key, self._instance_code_key]
+            keys.extend(self._study_dict.keys())
+            keys.extend(self._series_dict.keys())
+            keys.extend(self._instance_dict.keys())
+            js = {k: js[k] for k in keys if k in js}
+
+        if self.filter is not None:
+            reason = self.filter_reason(js, filename)
+            if reason is not None:
+                return (None, reason)
+
+        return ((js, None), None)
+
+    # Check a file against self.filter, see tree_filter.py. As in dicom_tree_prune.py, studies
+    # and series are checked by their entries in the tree, which come from their first file,
+    # so the result is kept. Returns None if the file passes, otherwise the reason to skip it
+    def filter_reason(self, js, filename=None):
+        checks = self._filter_checks
+        study_uid = js[self._study_code_key]['Value'][0]
+        series_uid = js[self._series_code_key]['Value'][0]
+
+        keep_study = self._filter_studies.get(study_uid)
+        if keep_study is None:
+            study = self.level_entries(self._study_code, self._study_code_key, self._study_dict, js)
+            keep_study = 'Study' not in checks or checks['Study'](study)
+            self._filter_studies[study_uid] = keep_study
+            if not keep_study:
+                self._rejected.add(study_uid)
+        if not keep_study:
+            return "filtered study"
+
+        keep_series = self._filter_series.get((study_uid, series_uid))
+        if keep_series is None:
+            series = self.level_entries(self._series_code, self._series_code_key, self._series_dict, js)
+            keep_series = 'Series' not in checks or checks['Series'](series)
+            self._filter_series[(study_uid, series_uid)] = keep_series
+            if not keep_series:
+                self._rejected.add((study_uid, series_uid))
+        if not keep_series:
+            return "filtered series"
+
+        if 'Instance' in checks:
+            if self.comprehensive:
+                self.register_tags(js)
+            if not checks['Instance'](self.create_instance(js, filename)):
+                return "filtered instance"
+        return None
 
-    def read_directory(self, recursive=1):
+    # Once a study or series has failed self.filter, its other files are skipped right
+    # after they are parsed, before the conversion to json. Returns None if the file is kept
+    def rejected_reason(self, ds):
+        try:
+            study_uid = str(ds[int(self._study_code_key, 16)].value)
+            series_uid = str(ds[int(self._series_code_key, 16)].value)
+        except KeyError:
+            return None
+
+        if study_uid in self._rejected:
+            return "filtered study"
+        if (study_uid, series_uid) in self._rejected:
+            return "filtered series"
+        return None
+
+    # The second item of a scan is unused, it held the tag dict of older comprehensive scans
+    def add_scan(self, filename, scan):
+        self.add_instance_json(filename, scan[0])
+
+    # Yield (filename, scan) for each file, in the order given. Files for which
+    # lookup(filename) returns a manifest entry are not read again
+    def scan_files(self, files, workers=None, lookup=None):
+        for f, scan, reason in self._scan_files(files, workers, lookup):
+            yield (f, scan)
+
+    # Yield (filename, scan, reason) and count the skipped files in self.skipped
+    def _scan_files(self, files, workers=None, lookup=None, chunksize=16):
+
+        if workers is None:
+            workers = self.workers
+
+        for f, scan, reason in self._scan_files_ordered(files, workers, lookup, chunksize):
+            if reason is not None:
+                self.skipped[reason] += 1
+            yield (f, scan, reason)
+
+    # Yield (filename, scan, reason) for each (filename, head) item, reading
+    # ahead the heads that are None if self.read_ahead is set
+    def try_scan_files(self, items):
+        if self.read_ahead <= 0:
+            for f, head in items:
+                yield (f,)+self.try_scan_file(f, head)
+            return
+
+        def read(item):
+            if item[1] is None:
+                return self.read_head(item[0])
+            return item[1]
+
+        for (f, _), head in read_ahead(items, read, self.read_ahead):
+            yield (f,)+self.try_scan_file(f, head)
+
+    def _scan_files_ordered(self, files, workers, lookup, chunksize):
+
+        # Archive members come as (filename, head), read while listing the archive
+        items = ((f, None) if isinstance(f, str) else f for f in files)
+
+        if workers <= 1:
+            def with_entries():
+                for f, head in items:
+                    entry = None
+                    if lookup is not None:
+                        entry = lookup(f)
+                    yield (f, head, entry)
+
+            def read(item):
+                f, head, entry = item
+                if head is None and entry is None:
+                    return self.read_head(f)
+                return head
+
+            if self.read_ahead > 0:
+                scanned = read_ahead(with_entries(), read, self.read_ahead)
+            else:
+                scanned = ((item, item[1]) for item in with_entries())
+
+            for (f, _, entry), head in scanned:
+                if entry is not None:
+                    self.scan_stats.files_cached += 1
+                    yield (f, entry["Scan"], entry.get("Skipped"))
+                else:
+                    yield (f,)+self.try_scan_file(f, head)
+            return
+
+        self.logger.info("Reading headers with %i workers" % workers)
+
+        # Chunks are submitted as files are found and results are taken in
+        # submission order, so the tree matches a serial scan
+        initargs = (self.scan_settings(),)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker, initargs=initargs) as pool:
+            pending = collections.deque()
+            chunk = []
+            for f, head in items:
+                entry = None
+                if lookup is not None:
+                    entry = lookup(f)
+
+                if entry is None:
+                    chunk.append((f, head))
+                    if len(chunk) < chunksize:
+                        continue
+                    pending.append(pool.submit(_scan_worker, chunk))
+                    chunk = []
+                else:
+                    if len(chunk) > 0:
+                        pending.append(pool.submit(_scan_worker, chunk))
+                        chunk = []
+                    self.scan_stats.files_cached += 1
+                    pending.append([(f, entry["Scan"], entry.get("Skipped"))])
+
+                # Keep a bounded number of chunks in flight
+                while len(pending) > workers*4:
+                    yield from self._scan_result(pending.popleft())
+
+            if len(chunk) > 0:
+                pending.append(pool.submit(_scan_worker, chunk))
+            while pending:
+                yield from self._scan_result(pending.popleft())
+
+    def _scan_result(self, item):
+        if isinstance(item, list):
+            return item
+        results, stats = item.result()
+        self.scan_stats.add(stats)
+        return results
+
+    # Tag configuration stored in the manifest, any change invalidates the cached scans
+    def manifest_config(self):
+        config = {"Version": 1, "Study": self.study_tags, "Series": self.series_tags,
+            "Instance": self.instance_tags, "Comprehensive": self.comprehensive, "Headerless": self.headerless}
+        if self.filter is not None:
+            config["Filter"] = self.filter
+        return config
+
+    def load_manifest(self):
+        if self.manifest is None or not os.path.exists(self.manifest):
+            return {}
+
+        try:
+            with open_tree_file(self.manifest) as f:
+                manifest = json.load(f)
+        except:
+            self.logger.warning("Could not read manifest: %s" % self.manifest)
+            return {}
+
+        # Round trip through json so the comparison sees the same types
+        config = json.loads(json.dumps(self.manifest_config()))
+        if manifest.get("Config") != config:
+            self.logger.info("Tag configuration changed, ignoring manifest: %s" % self.manifest)
+            return {}
+
+        return manifest.get("Files", {})
+
+    def save_manifest(self, files):
+        manifest = {"Config": self.manifest_config(), "Files": files}
+        # Keep the extension, it says if the manifest is compressed
+        base, ext = os.path.splitext(self.manifest)
+        tmp_name = base+".tmp"+ext
+        with open_tree_file(tmp_name, 'w') as f:
+            dump(manifest, f, compact=True)
+        os.replace(tmp_name, self.manifest)
+        self.logger.info("Wrote manifest: %s" % self.manifest)
+
+    # Like scan_files() but reuse scans from the manifest for files with the same size and mtime
+    def scan_files_cached(self, files, workers=None):
+
+        cached = self.load_manifest()
+        entries = {}
+
+        def lookup(f):
+            size, mtime = file_stat(f)
+            entry = cached.get(f)
+            if entry is not None and entry["Size"]==size and entry["MTime"]==mtime and not is_read_error(entry.get("Skipped")):
+                entries[f] = entry
+                return entry
+            entries[f] = {"Size": size, "MTime": mtime, "Scan": None}
+            return None
+
+        n_reused = 0
+        for f, scan, reason in self._scan_files(files, workers, lookup):
+            if entries[f] is cached.get(f):
+                n_reused += 1
+            entries[f]["Scan"] = scan
+            if reason is not None:
+                entries[f]["Skipped"] = reason
+            yield (f, scan)
+
+        n_dropped = len([f for f in cached if f not in entries])
+        self.logger.info("Manifest: reused %i files, read %i files, dropped %i files" % 
+            (n_reused, len(entries)-n_reused, n_dropped))
+
+        # Files with read errors are left out, so they are read again next time
+        errors = [f for f, entry in entries.items() if is_read_error(entry.get("Skipped"))]
+        if len(errors) > 0:
+            self.logger.warning("Manifest: %i files with read errors will be read again next time" % len(errors))
+            for f in errors:
+                del entries[f]
+
+        self.save_manifest(entries)
+
+    # Yield files as they are found, keeping the list in self.files
+    def find_files(self, recursive=1):
+        for f, head in self.find_items(recursive):
+            yield f
+
+    # Yield (filename, head) for each file as it is found. The head is None
+    # except for archive members, which are read in order while listing
+    def find_items(self, recursive=1):
+        self.files = []
+        stats = self.scan_stats
+        walk = self.walk_items(recursive)
+        while True:
+            t0 = time.perf_counter()
+            item = next(walk, None)
+            stats.seconds["list"] += time.perf_counter()-t0
+            if item is None:
+                return
+            stats.files_listed += 1
+
+            f = item[0]
+            if self.shard is not None:
+                index, count = self.shard
+                if shard_of(os.path.relpath(f, self.directory), count) != index:
+                    continue
+            self.files.append(f)
+            yield item
+
+    # The directory may itself be an archive, archives in it are only opened if self.archives is set
+    def walk_items(self, recursive=1):
+        if os.path.isfile(self.directory) and is_archive(self.directory):
+            paths = [self.directory]
+        else:
+            paths = walk_files(self.directory, depth=recursive)
+
+        for path in paths:
+            yield from self.path_items(path)
+
+    # Items of one file found in the directory, its members if it is an archive to open
+    def path_items(self, path):
+        if not is_archive(path) or (path != self.directory and not self.archives):
+            yield (path, None)
+            return
+
+        try:
+            yield from iter_members(path, self.read_ahead_size)
+        except Exception as e:
+            self.logger.warning("Could not read archive %s: %s" % (path, str(e)))
+            self.skipped["archive read error "+type(e).__name__] += 1
+
+    def read_directory(self, recursive=1, workers=None):
 
         self.get_tag_dicts()
+        self.scan_stats = ScanStats()
+        stats = self.scan_stats
+        t0 = time.perf_counter()
+
+        if self.shard is not None:
+            self.logger.info("Scanning shard %i/%i" % self.shard)
+
+        files = self.find_items(recursive)
+        if self.manifest is not None:
+            scans = self.scan_files_cached(files, workers)
+        else:
+            scans = self.scan_files(files, workers)
 
-        #for level, (dirpath, dirnames, filenames) in enumerate(os.walk(self.directory)):
-        #    fullnames = [os.path.join(dirpath,x) for x in filenames]
-        #    self.files.extend(fullnames)
-        #    if level >= recursive:
-        #        break       
-        self.files = list_files(self.directory, levels=2)
+        for f, scan in scans:
+            if scan is not None:
+                t1 = time.perf_counter()
+                self.add_scan(f, scan)
+                stats.seconds["insert"] += time.perf_counter()-t1
 
+        stats.scan_seconds = time.perf_counter()-t0
         self.logger.info("Found %i candidate files" % len(self.files)) 
+        self.log_skipped()
+        self.log_read_rate(stats.scan_seconds)
+        self.log_scan_stats()
 
-        for i,f in enumerate(self.files):
-            #print(i)
-            ds=None
-            try:
-                ds = pydicom.dcmread(f,stop_before_pixels=True)
-            except:
-                self.logger.warning("Could not read file: %s" % f)
+        if self.targeted and not self.comprehensive:
+            self.compare_read_times()
 
-                # Force reading can be problematic. Need more checks on the
-                # file before adding to ensure it is a valid dicom file
+    # Scan more files into the tree, e.g. files that arrived in watch mode.
+    # Returns the set of StudyInstanceUIDs that got new instances
+    def add_files(self, files, workers=None):
+        self.get_tag_dicts()
+        stats = self.scan_stats
+        items = [item for f in files for item in self.path_items(f)]
+        self.files.extend([item[0] for item in items])
+
+        updated = set()
+        for f, scan in self.scan_files(items, workers):
+            if scan is not None:
+                t1 = time.perf_counter()
+                n_inserted = stats.instances_inserted
+                self.add_scan(f, scan)
+                stats.seconds["insert"] += time.perf_counter()-t1
+                if stats.instances_inserted > n_inserted:
+                    updated.add(scan[0][self._study_code_key]['Value'][0])
+        return updated
+
+    def watch_directory(self, recursive=1, interval=5.0, quiet_period=300.0, use_inotify=True,
+            on_update=None, on_complete=None):
+        """
+        Scans the directory, then keeps adding files as they arrive until interrupted (KeyboardInterrupt).
+
+        Args:
+            recursive: How many directories deep to search (-1 for all).
+            interval: Seconds between checks for new files (the longest wait with inotify).
+            quiet_period: Seconds without new instances after which a study is complete.
+            use_inotify: Use inotify when inotify_simple is installed, otherwise poll.
+            on_update: Called with no arguments after the tree gets new instances.
+            on_complete: Called with a study when it is complete. A study that gets new instances later is completed again.
+        """
+
+        # Watch before the first scan so no file is missed between them
+        watcher = FileWatcher(self.directory, recursive, use_inotify)
+        self.logger.info("Watching %s for new files (%s)" % (self.directory, watcher.mode))
 
-                #try:
-                #    ds = pydicom.dcmread(f,force=True,stop_before_pixels=True)
-                #except:
-                #    logging.warning("Could not read file: %s" % f)
-                #else:
-                #    logging.warning("Forced reading of file: %s" % f)
+        try:
+            self.read_directory(recursive)
+            watcher.mark_read(self.files)
+
+            last_update = {}        # StudyInstanceUID -> time of its last new instance
+            now = time.monotonic()
+            for study in self.studies:
+                last_update[study[self._study_code['Name']]['Value'][0]] = now
+            if on_update is not None:
+                on_update()
+
+            while True:
+                files = watcher.wait(interval)
+                if len(files) > 0:
+                    # A process pool only pays off for larger batches
+                    workers = self.workers if len(files) >= 64 else 1
+                    updated = self.add_files(files, workers)
+                    self.logger.info("Read %i new files, %i studies updated" % (len(files), len(updated)))
+
+                    now = time.monotonic()
+                    for study_uid in updated:
+                        last_update[study_uid] = now
+                    if len(updated) > 0 and on_update is not None:
+                        on_update()
+
+                now = time.monotonic()
+                for study_uid in [uid for uid, t in last_update.items() if now-t >= quiet_period]:
+                    del last_update[study_uid]
+                    self.logger.info("Study complete: "+study_uid)
+                    if on_complete is not None:
+                        on_complete(self.find_study(study_uid))
+        finally:
+            watcher.close()
+
+    # One summary line for all skipped files, instead of a warning per file
+    def log_skipped(self):
+        n_skipped = sum(self.skipped.values())
+        if n_skipped > 0:
+            reasons = ", ".join(["%i %s" % (n, reason) for reason, n in self.skipped.most_common()])
+            self.logger.warning("Skipped %i files: %s" % (n_skipped, reasons))
+
+    def log_read_rate(self, elapsed):
+        rate = len(self.files)/elapsed if elapsed > 0 else 0.0
+        bytes_read = self.scan_stats.bytes_read
+        msg = "Scanned %i files in %.2fs (%.1f files/s)" % (len(self.files), elapsed, rate)
+        msg += ", read %.1f MB (%.1f MB/s)" % (bytes_read/1e6, bytes_read/1e6/elapsed if elapsed > 0 else 0.0)
+        self.logger.info(msg)
+
+    def log_scan_stats(self):
+        stats = self.scan_stats
+        phases = ", ".join(["%s %.2fs" % (phase, stats.seconds[phase]) for phase in stats.PHASES])
+        self.logger.info("Scan phases: %s" % phases)
+        self.logger.info("Read %i of %i files (%i cached), inserted %i instances (%i duplicates)" %
+            (stats.files_read, stats.files_listed, stats.files_cached, stats.instances_inserted, stats.duplicates))
+
+    # Time full and targeted reads of a sample of the scanned files and log the speedup.
+    # The modes take turns through the sample and each file is read once, so
+    # neither mode reads a file the other has just brought into the page cache
+    def compare_read_times(self, n=20):
+        step = max(1, len(self.files) // (2*n))
+        times = {"full": 0.0, "targeted": 0.0}
+        counts = {"full": 0, "targeted": 0}
+        for i, f in enumerate(self.files[::step][:2*n]):
+            mode = "full" if i % 2 == 0 else "targeted"
+            try:
+                t0 = time.perf_counter()
+                if mode == "full":
+                    pydicom.dcmread(f,stop_before_pixels=True)
+                else:
+                    self.read_file_targeted(f)
+                t1 = time.perf_counter()
+            except:
+                continue
+            times[mode] += t1-t0
+            counts[mode] += 1
 
-            if not ds is None:
-                self.add_instance(f,ds)
+        if counts["full"] > 0 and counts["targeted"] > 0 and times["targeted"] > 0:
+            full_time = times["full"]/counts["full"]
+            targeted_time = times["targeted"]/counts["targeted"]
+            self.logger.info("Targeted read speedup: %.2fx (full %.5fs, targeted %.5fs per file, %i+%i files)" %
+                (full_time/targeted_time, full_time, targeted_time, counts["full"], counts["targeted"]))
 
     # Get a value for a dicom tag from the tag name
     def get_tag_value( self, tag ):
@@ -469,6 +1452,7 @@ class DicomTree:
     def grow(self, directory):
         self.directory = directory
         self.studies = []
+        self.build_index()
 
     def grow_study(self, study={}):
         new_study = study.copy()
@@ -512,43 +1496,104 @@ class DicomTree:
     def to_json(self, filename):
         outTree = {"Directory": self.directory, "StudyList": self.studies}
 
-        with open(filename, 'w', encoding='utf-8') as f:
-            self.logger.info("Writing to: "+filename)
-            json.dump(outTree, f, ensure_ascii=False, indent=4)
+        self.logger.info("Writing to: "+filename)
+        save_tree(outTree, filename, self.compact)
 
     def contiguous_series(self):
         for study in self.studies:
             for series in study["SeriesList"]:
-                inst_list=[]
-                position_list=[]
-                for instance in series["InstanceList"]:
-                    if "InstanceNumber" in instance:
-                        inst_list.append(instance["InstanceNumber"]["Value"][0])
-                    if "SliceLocation" in instance:
-                        position_list.append(instance["SliceLocation"]["Value"][0])
+                inst_nums = series_first_values(series, "InstanceNumber")
+                inst_list = [x for x in inst_nums if x is not None]
+
+                inst_num_consecutive = set(longest_consecutive_sequences(inst_list, first=True))
+                rows = [i for i, x in enumerate(inst_nums) if x is not None and x in inst_num_consecutive]
+
+                series["InstanceList"]=select_rows(series["InstanceList"], rows)
+
+        self.build_index()
+
 
-                inst_num_consecutive = longest_consecutive_sequences(inst_list, first=True)
-                inst_consecutive=[]
-                for instance in series["InstanceList"]:
-                    if "InstanceNumber" in instance:
-                        if instance["InstanceNumber"]["Value"][0] in inst_num_consecutive:
-                            inst_consecutive.append(instance)   
 
-                series["InstanceList"]=inst_consecutive
+# Write dicomTree.scan_stats, with the reasons files were skipped, for --stats_json
+def write_scan_stats(dicomTree, filename):
+    stats = dicomTree.scan_stats.to_dict()
+    stats["Directory"] = dicomTree.directory
+    stats["Workers"] = dicomTree.workers
+    stats["Skipped"] = dict(dicomTree.skipped)
+    dicomTree.logger.info("Writing scan stats to: "+filename)
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=4)
 
+def watch(dicomTree, args, logger):
+    """
+    Runs dicom_tree.py --watch until it is stopped by SIGINT or SIGTERM. The
+    tree is kept in memory and the output, in any format, is replaced after
+    each batch of new instances.
+    """
 
+    def write_output():
+        outTree = {"Directory": args.path, "StudyList": dicomTree.studies}
+        if args.common:
+            outTree = hoisted_copy(outTree)
+        replace_tree(outTree, args.output, args.compact)
+        if args.index:
+            write_index(args.output)
+        logger.info("Wrote %s" % args.output)
+
+    def write_completed(study):
+        if args.completed is None:
+            return
+        accession = study.get("AccessionNumber", {}).get("Value")
+        record = {"StudyInstanceUID": study[dicomTree._study_code['Name']]['Value'][0],
+            "AccessionNumber": accession[0] if accession else None,
+            "Series": len(study['SeriesList']),
+            "Instances": sum([len(series['InstanceList']) for series in study['SeriesList']]),
+            "Output": args.output, "Time": datetime.now().isoformat(timespec='seconds')}
+        with open(args.completed, 'a', encoding='utf-8') as f:
+            f.write(dumps_line(record)+"\n")
+
+    # Stop on SIGTERM (e.g. from a job scheduler) the same way as on ctrl-c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        dicomTree.watch_directory(args.recursive, args.interval, args.quiet_period, not args.poll,
+            on_update=write_output, on_complete=write_completed)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching: %i studies, %i files read" % (len(dicomTree.studies), len(dicomTree.files)))
+
+    if args.stats_json is not None:
+        write_scan_stats(dicomTree, args.stats_json)
+    return(0)
 
 def main():
 
     my_parser = argparse.ArgumentParser(description='Extract DICOM Header Info')
-    my_parser.add_argument('-p', '--path', type=str, help='the path to the directory', required=True)
+    my_parser.add_argument('-p', '--path', type=str, help='the path to the directory, or a zip or tar file', required=True)
     my_parser.add_argument('-a', '--accession', type=str, help='accession number', required=False)
-    my_parser.add_argument('-r', '--recursive', dest="recursive", help="how many directories deep to search", type=int, default=0)
+    my_parser.add_argument('-r', '--recursive', dest="recursive", help="how many directories deep to search (-1 for all)", type=int, default=1)
     my_parser.add_argument('-o', '--output', type=str, help='output json file', required=True)
     my_parser.add_argument('-t', '--tagfile', type=str, help='json file of dicom tags to include', required=False)
     my_parser.add_argument('-l', '--log', type=str, help='logfile', required=False, default=None)
     my_parser.add_argument('-n', '--name', help='include name of each tag', default=False, required=False, action='store_true')
     my_parser.add_argument('-c', '--comprehensive', help='include all non-private & non-pixel tags', default=False, required=False, action='store_true')    
+    my_parser.add_argument('-w', '--workers', type=int, help='number of processes used to read headers', required=False, default=1)
+    my_parser.add_argument('--targeted', help='only parse the tags being extracted', default=False, required=False, action='store_true')
+    my_parser.add_argument('--headerless', help='also read files without a DICM preamble that look like DICOM', default=False, required=False, action='store_true')
+    my_parser.add_argument('--columnar', help='store instance lists by column to reduce memory', default=False, required=False, action='store_true')
+    my_parser.add_argument('--read_ahead', type=int, help='number of files read into memory ahead of the parser (0 to disable)', required=False, default=0)
+    my_parser.add_argument('--read_ahead_kb', type=int, help='KB read ahead for each file, longer headers are read from the file', required=False, default=64)
+    my_parser.add_argument('-f', '--filter', type=str, help='json file of checks as for dicom_tree_prune.py, files that fail them are not added', required=False, default=None)
+    my_parser.add_argument('--archives', help='also scan inside zip and tar files in the directory', default=False, required=False, action='store_true')
+    my_parser.add_argument('--shard', type=parse_shard, help='only scan shard i of N (given as i/N), see dicom_tree_merge.py', required=False, default=None)
+    my_parser.add_argument('--index', help='also write an sqlite index of the tree (OUTPUT.sqlite) for dicom_tree_get.py', default=False, required=False, action='store_true')
+    my_parser.add_argument('--compact', help='write json without indentation or spaces', default=False, required=False, action='store_true')
+    my_parser.add_argument('--common', help='move instance tags that are the same for a whole series into its Common block', default=False, required=False, action='store_true')
+    my_parser.add_argument('--stats_json', type=str, help='json file of scan phase times and counters', required=False, default=None)
+    my_parser.add_argument('--watch', help='keep running, adding new files to the tree and rewriting the output as they arrive', default=False, required=False, action='store_true')
+    my_parser.add_argument('--interval', type=float, help='seconds between checks for new files with --watch', required=False, default=5.0)
+    my_parser.add_argument('--quiet_period', type=float, help='seconds without new files after which a study is complete with --watch', required=False, default=300.0)
+    my_parser.add_argument('--completed', type=str, help='ndjson file where each study is recorded when it is complete with --watch', required=False, default=None)
+    my_parser.add_argument('--poll', help='poll for new files with --watch even if inotify is available', default=False, required=False, action='store_true')
+    my_parser.add_argument('-m', '--manifest', type=str, help='json file of cached scans, only new or changed files are read', required=False, default=None)
     
     args = my_parser.parse_args()
 
@@ -581,7 +1626,7 @@ def main():
             with open(args.tagfile) as f:
                 tags = json.load(f)
 
-    if not os.path.isdir(str(args.path)):
+    if not os.path.isdir(str(args.path)) and not (os.path.isfile(str(args.path)) and is_archive(args.path)):
         logger.error("Path does not exist: %s" % args.path)
         return(1)
 
@@ -589,6 +1634,20 @@ def main():
     dicomTree = DicomTree(args.path, make_logger=False)
     dicomTree.comprehensive=args.comprehensive
     dicomTree.use_name=args.name
+    dicomTree.workers=args.workers
+    dicomTree.targeted=args.targeted
+    dicomTree.manifest=args.manifest
+    dicomTree.headerless=args.headerless
+    dicomTree.columnar=args.columnar
+    dicomTree.read_ahead=args.read_ahead
+    dicomTree.read_ahead_size=args.read_ahead_kb*1024
+    dicomTree.shard=args.shard
+    dicomTree.archives=args.archives
+    if args.filter is not None:
+        logger.info("Reading filter file: %s" % args.filter)
+        with open(args.filter) as f:
+            dicomTree.filter = json.load(f)
+    dicomTree.compact=args.compact
 
     dicomTree.logger=logger
 
@@ -611,16 +1670,41 @@ def main():
         else:
             dicomTree.set_default_instance_tags()
 
+    if args.watch:
+        return(watch(dicomTree, args, logger))
+
+    # ndjson output is written while scanning, so the full tree is never in memory
+    if is_ndjson(args.output):
+        if args.common:
+            logger.warning("--common is not used for ndjson output, instances are written as they are read")
+        with open_tree_file(args.output, 'w') as f:
+            logger.info("Writing to: "+args.output)
+            dicomTree.stream_to(f)
+            dicomTree.read_directory(args.recursive)
+
+        finish = datetime.now()
+        logger.info("Tree build time: %s" % str(finish-start))
+        if args.stats_json is not None:
+            write_scan_stats(dicomTree, args.stats_json)
+        if args.index:
+            logger.info("Writing index: "+write_index(args.output))
+        return(0)
+
     dicomTree.read_directory(args.recursive)
         
     finish = datetime.now()
     logger.info("Tree build time: %s" % str(finish-start))
+    if args.stats_json is not None:
+        write_scan_stats(dicomTree, args.stats_json)
 
     outTree = {"Directory": args.path, "StudyList": dicomTree.studies}
+    if args.common:
+        logger.info("Moved %i instance tags to series Common blocks" % hoist_tree(outTree))
 
-    with open(args.output, 'w', encoding='utf-8') as f:
-        logger.info("Writing to: "+args.output)
-        json.dump(outTree, f, ensure_ascii=False, indent=4)
+    logger.info("Writing to: "+args.output)
+    save_tree(outTree, args.output, args.compact)
+    if args.index:
+        logger.info("Writing index: "+write_index(args.output))
 
     return(0)
 
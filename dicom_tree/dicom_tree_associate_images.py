@@ -14,12 +14,19 @@ import glob
 import itk
 import numpy as np
 
+try:
+    from .tree_io import load_tree
+    from .series_common import series_instances
+except ImportError:
+    from tree_io import load_tree
+    from series_common import series_instances
+
 def condense_instance_list(series, only_original=True, key_list=None):
 
     # scan once to find out what all is there
     if key_list is None:
         key_list=[]
-        for instance in series.get("InstanceList"):
+        for instance in series_instances(series):
             ikeys = list(instance.keys())
             ikeys.remove("Filename")
             key_list += ikeys
@@ -28,7 +35,7 @@ def condense_instance_list(series, only_original=True, key_list=None):
 
     instance_summary={}
 
-    for instance in series.get("InstanceList"):
+    for instance in series_instances(series):
         if only_original:
             if "00080008" in instance:
                 if instance["00080008"]['Value'][0] != "ORIGINAL":
@@ -95,8 +102,7 @@ def main():
 
 
     logger.info("Reading tree file: %s" % args.tree)
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    tree = load_tree(args.tree)
 
     if len(tree['StudyList']) > 1:
         logger.error("Can only associate for one study")
@@ -11,6 +11,13 @@ from datetime import datetime
 import logging
 import json
 
+try:
+    from .tree_reader import iter_tree
+    from .series_common import series_instances
+except ImportError:
+    from tree_reader import iter_tree
+    from series_common import series_instances
+
 def longest_identical_sequence_indices(lst, tolerance=None):
     """Finds the indices of the longest sequence of identical values in a list.
 
@@ -164,24 +171,24 @@ def main():
     args = my_parser.parse_args()
 
     logging.info("Reading tree file: %s" % args.tree)
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
-
-
-    for study in tree['StudyList']:
-        keep_study=True
 
-        print(str(study.get("StudyInstanceUID").get("Value")[0]))
-        #print("Check study: "+str(study.get("00080050").get("Value")))
+    # Studies and series are read one at a time
+    for event, node, count in iter_tree(args.tree):
 
+        if event=="study":
+            study=node
+            keep_study=True
 
+            print(str(study.get("StudyInstanceUID").get("Value")[0]))
+            #print("Check study: "+str(study.get("00080050").get("Value")))
 
-        for series in study['SeriesList']:
+        if event=="series":
+            series=node
             acq_list = []
             mod_list = []
             inst_list = []
             position_list = []
-            for instance in series['InstanceList']:
+            for instance in series_instances(series):
                 if "AcquisitionNumber" in instance:
                     acq = get_value(instance, "AcquisitionNumber")
                     if acq not in acq_list:
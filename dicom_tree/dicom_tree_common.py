@@ -0,0 +1,59 @@
+import sys
+import os
+import argparse
+from datetime import datetime
+import logging
+
+try:
+    from .tree_io import load_tree, save_tree
+    from .series_common import hoist_tree, expand_tree
+except ImportError:
+    from tree_io import load_tree, save_tree
+    from series_common import hoist_tree, expand_tree
+
+def main():
+
+    my_parser = argparse.ArgumentParser(description='Move instance tags that are the same for a whole series into a series Common block')
+    my_parser.add_argument('-t', '--tree', type=str, help='tree file to normalize', required=True)
+    my_parser.add_argument('-o', '--output', type=str, help='output tree file', required=True)
+    my_parser.add_argument('-e', '--expand', help='copy Common blocks back into each instance instead', default=False, required=False, action='store_true')
+    my_parser.add_argument('--compact', help='write json without indentation or spaces', default=False, required=False, action='store_true')
+    args = my_parser.parse_args()
+
+    slurminfo=''
+    slurmtask=os.environ.get('SLURM_ARRAY_TASK_ID')
+    slurmid=os.environ.get('SLURM_JOB_ID')
+    if slurmid is not None:
+        slurminfo="- SLURM="+slurmid
+        if slurmtask is not None:
+            slurminfo = slurminfo+"_"+slurmtask
+
+    formatter = logging.Formatter(fmt=f'%(asctime)s %(name)s %(levelname)-8s %(message)s {slurminfo}', datefmt='%Y-%m-%d %H:%M:%S')
+    logger = logging.getLogger("dicom_tree_common")
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    if not os.path.exists(args.tree):
+        logger.error("Tree file does not exist: "+args.tree)
+        return(1)
+
+    start = datetime.now()
+    logger.info("Reading tree file: "+args.tree)
+    tree = load_tree(args.tree)
+
+    if args.expand:
+        expand_tree(tree)
+        logger.info("Expanded series Common blocks")
+    else:
+        logger.info("Moved %i instance tags to series Common blocks" % hoist_tree(tree))
+    logger.info("Normalize time: %s" % str(datetime.now()-start))
+
+    logger.info("Writing to: "+args.output)
+    save_tree(tree, args.output, args.compact)
+
+    return(0)
+
+if __name__=="__main__":
+    sys.exit(main())
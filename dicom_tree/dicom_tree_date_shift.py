@@ -11,6 +11,11 @@ import datetime
 import logging
 import json
 
+try:
+    from .tree_io import load_tree, save_tree
+except ImportError:
+    from tree_io import load_tree, save_tree
+
 def shift_date(date, days):
     date_stmp = datetime.datetime.strptime(date, '%Y%m%d')
     date_stmp = date_stmp + datetime.timedelta(days=days)
@@ -24,13 +29,13 @@ def main():
     my_parser.add_argument('-i', '--input', type=str, help='json file of dicom studies to filter', required=True)
     my_parser.add_argument('-d', '--days_offset', type=float, help='days to shift dates by', required=True)
     my_parser.add_argument('-o', '--output', type=str, help='date shifted dicom tree', required=True)
+    my_parser.add_argument('--compact', action='store_true', help='write json without indentation or spaces', default=False, required=False)
     args = my_parser.parse_args()
 
     args.days_offset = int(args.days_offset)
 
     logging.info("Reading tree file: %s" % args.input)
-    tree_file = open(args.input)
-    tree = json.load(tree_file)
+    tree = load_tree(args.input)
 
     for study in tree.get('StudyList'):
         study_date_keys = [ x for x in study.keys() if 'Date' in x]
@@ -44,14 +49,20 @@ def main():
                 logging.info("Shifting Series-level "+series_date_key)
                 series[series_date_key]['Value'][0]=shift_date(series[series_date_key]['Value'][0], args.days_offset)
 
+            # Dates shared by all instances are kept once in the series 'Common' block
+            common = series.get("Common", {})
+            common_date_keys = [ x for x in common.keys() if 'Date' in x]
+            for common_date_key in common_date_keys:
+                logging.info("Shifting Instance-level "+common_date_key)
+                common[common_date_key]['Value'][0]=shift_date(common[common_date_key]['Value'][0], args.days_offset)
+
             for instance in series.get("InstanceList"):
                 instance_date_keys = [ x for x in instance.keys() if 'Date' in x]
                 for instance_date_key in instance_date_keys:
                     logging.info("Shifting Instance-level "+instance_date_key)
                     instance[instance_date_key]['Value'][0]=shift_date(instance[instance_date_key]['Value'][0], args.days_offset)
 
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(tree, f, ensure_ascii=False, indent=4)
+    save_tree(tree, args.output, args.compact)
 
     logging.info("Shifted Dates written to file: %s" % args.output)
 
@@ -3,6 +3,15 @@ import os
 import argparse
 import json
 
+try:
+    from .tree_reader import iter_tree
+    from .tree_index import open_index, count_nodes, tag_entries
+    from .series_common import series_instances
+except ImportError:
+    from tree_reader import iter_tree
+    from tree_index import open_index, count_nodes, tag_entries
+    from series_common import series_instances
+
 def get_tag(struct, check):
     el = check.get('Group')+check.get('Element')
     return( struct.get(el) )
@@ -57,6 +66,32 @@ def get_value(dict, name, index=None, sequence=None):
     
 
 
+# Answer a query from the sqlite index of the tree, giving the same output as reading the tree
+def query_index(conn, args):
+
+    counts = {"nstudies": "study", "nseries": "series", "ninstances": "instance"}
+    if args.name in counts:
+        print(count_nodes(conn, counts[args.name]))
+        return(0)
+
+    if args.level not in ('study', 'series', 'instance'):
+        if count_nodes(conn, 'instance') > 0:
+            print("ERROR: Unknown level: "+args.level)
+            return(1)
+        print("NA")
+        return(0)
+
+    output = []
+    for entry in tag_entries(conn, args.level, args.name):
+        output.append(get_value({args.name: entry}, args.name, index=args.index, sequence=args.sequence))
+
+    if len(output)==0:
+        print("NA")
+    else:
+        print(",".join(output))
+
+    return(0)
+
 def main():
 
     my_parser = argparse.ArgumentParser(description='Check dicom tag names')
@@ -67,49 +102,57 @@ def main():
     my_parser.add_argument('-i', '--index', type=str, help='index', required=False)
     args = my_parser.parse_args()
 
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    # Use the index written by --index in dicom_tree.py or dicom_tree_prune.py if it is up to date
+    conn = open_index(args.tree)
+    if conn is not None:
+        return(query_index(conn, args))
 
+    # Counts skip the lists below the level being counted
     if args.name=="nstudies":
-        print(len(tree['StudyList']))
+        nstudies=0
+        for event, node, count in iter_tree(args.tree, depth='study'):
+            if event=="end":
+                nstudies=count
+        print(nstudies)
         return(0)
     
     if args.name=="nseries":
         nseries=0
-        for study in tree['StudyList']:
-            nseries += len(study['SeriesList'])
+        for event, node, count in iter_tree(args.tree, depth='study'):
+            if event=="end_study":
+                nseries += count
         print(nseries)
         return(0)
     
     if args.name=="ninstances":
         ninstances=0
-        for study in tree['StudyList']:
-            for series in study['SeriesList']:
-                ninstances += len(series['InstanceList'])
+        for event, node, count in iter_tree(args.tree, depth='series'):
+            if event=="series":
+                ninstances += count
         print(ninstances)
         return(0)
 
+    depth = args.level
+    if depth not in ('study', 'series'):
+        depth = 'instance'
               
     output = []
-    for study in tree['StudyList']:
+    for event, node, count in iter_tree(args.tree, depth=depth):
         if args.level=='study':
-            if args.name in study.keys():
-                value = study.get(args.name)['Value']
-
-                output.append(get_value(study, args.name, index=args.index, sequence=args.sequence))
-        else:
-            for series in study['SeriesList']:
-                if args.level=='series':
-                    if args.name in series.keys():
-                        output.append(get_value(series, args.name, index=args.index, sequence=args.sequence))
-                else:
-                    for instance in series['InstanceList']:
-                        if args.level=='instance':
-                            if args.name in instance.keys():
-                                output.append(get_value(instance, args.name, index=args.index, sequence=args.sequence))
-                        else:
-                            print("ERROR: Unknown level: "+args.level)
-                            return(1)
+            if event=="end_study" and args.name in node.keys():
+                output.append(get_value(node, args.name, index=args.index, sequence=args.sequence))
+        elif event=="series":
+            if args.level=='series':
+                if args.name in node.keys():
+                    output.append(get_value(node, args.name, index=args.index, sequence=args.sequence))
+            else:
+                for instance in series_instances(node):
+                    if args.level=='instance':
+                        if args.name in instance.keys():
+                            output.append(get_value(instance, args.name, index=args.index, sequence=args.sequence))
+                    else:
+                        print("ERROR: Unknown level: "+args.level)
+                        return(1)
     if len(output)==0:
         print("NA")
     else:                      
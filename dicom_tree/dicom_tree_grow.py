@@ -12,11 +12,39 @@ from pydicom.uid import generate_uid
 from datetime import datetime
 import logging
 import json
-import SimpleITK as sitk
-import numpy as np
+
+# Only needed to read the input image
+try:
+    import SimpleITK as sitk
+    import numpy as np
+except ImportError:
+    sitk = None
 
 from dicom_tree import DicomTree
 
+def add_template_tags(ds, tag_list, series_index=0, instance_index=None):
+    """
+    Adds the tags of a template (see mr_input.json) to a dataset.
+
+    Args:
+        ds: The dataset for one instance.
+        tag_list: A dict with a 'Study' list of tags, and optionally 'Series' and 'Instance' lists of tag lists.
+        series_index: Which 'Series' list to use.
+        instance_index: Which 'Instance' list to use, or None to skip instance tags.
+    """
+
+    for tag in tag_list['Study']:
+        tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
+        ds.add(tag_element)
+    if 'Series' in tag_list:
+        for tag in tag_list['Series'][series_index]:
+            tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
+            ds.add(tag_element)
+    if 'Instance' in tag_list and instance_index is not None:
+        for tag in tag_list['Instance'][instance_index]:
+            tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
+            ds.add(tag_element)
+
 
 def main():
     logging.basicConfig(level=logging.INFO)
@@ -31,6 +59,10 @@ def main():
     args = my_parser.parse_args()
     print(args)
 
+    if sitk is None:
+        logging.error("SimpleITK is needed to read the input image")
+        return(1)
+
     logging.info("Reading Image: "+args.input)
     img_raw = sitk.ReadImage(args.input)
     filter_lps = sitk.DICOMOrientImageFilter()
@@ -129,17 +161,7 @@ def main():
             instance_dat.SliceLocation = position[2]
             
 
-            for tag in tag_list['Study']:
-                tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
-                instance_dat.add(tag_element)
-            if 'Series' in tag_list:
-                for tag in tag_list['Series'][series_index]:
-                    tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
-                    instance_dat.add(tag_element)
-            if 'Instance' in tag_list:
-                for tag in tag_list['Instance'][i]:
-                    tag_element = pydicom.DataElement( (tag['Group'], tag['Element']), tag['vr'], tag['Value'])
-                    instance_dat.add(tag_element)      
+            add_template_tags(instance_dat, tag_list, series_index, i)
 
             #FIXME - flip either axis?
             slice_img = sitk.GetArrayFromImage(img[:,:,i])
@@ -11,6 +11,13 @@ from datetime import datetime
 import logging
 import json
 
+try:
+    from .tree_io import load_tree
+    from .series_common import resolve_instance
+except ImportError:
+    from tree_io import load_tree
+    from series_common import resolve_instance
+
 def get_tag(struct, check):
     el = check.get('Group')+check.get('Element')
     return( struct.get(el) )
@@ -59,8 +66,7 @@ def main():
     args = my_parser.parse_args()
 
     logging.info("Reading tree file: %s" % args.tree)
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    tree = load_tree(args.tree)
 
     # For now, limited to a tree with only one study and one series
     if len(tree['StudyList']) > 1:
@@ -72,7 +78,7 @@ def main():
     
     study=tree['StudyList'][0]
     series=study['SeriesList'][0]
-    instance=series['InstanceList'][0]
+    instance=resolve_instance(series.get('Common'), series['InstanceList'][0])
 
     # Values from the tree will be in every line of the output
     series_dict={}
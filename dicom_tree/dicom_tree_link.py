@@ -2,7 +2,15 @@ import sys
 import os
 import argparse
 import logging
-import json
+
+try:
+    from .tree_io import load_tree
+    from .tree_json import dump_tree
+    from .archive_members import is_member, extract_members
+except ImportError:
+    from tree_io import load_tree
+    from tree_json import dump_tree
+    from archive_members import is_member, extract_members
 
 def clean_string(in_str):
 
@@ -28,6 +36,7 @@ def main():
     my_parser.add_argument('-o', '--output', type=str, help='output directory for links', required=True)
     my_parser.add_argument('-s', '--series', type=str, help='output directory for series trees', required=False)
     my_parser.add_argument('-a', '--alias', type=str, help='alias name for subdirectories', required=False)
+    my_parser.add_argument('--compact', action='store_true', help='write json without indentation or spaces', default=False, required=False)
 
     args = my_parser.parse_args()
 
@@ -52,8 +61,10 @@ def main():
     logger.addHandler(ch)
 
     logger.info("Linking tree file: " + args.tree)
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    tree = load_tree(args.tree)
+
+    # Files in archives are extracted instead of linked, one pass over each archive
+    extracts = []
 
     for study in tree.get('StudyList'):
         for series in study.get("SeriesList"):
@@ -73,7 +84,7 @@ def main():
                 if not os.path.exists(args.series):
                     os.makedirs(args.series)
                 with open(tree_name, 'w', encoding='utf-8') as f:
-                    json.dump(series_tree, f, indent=4)
+                    dump_tree(series_tree, f, args.compact)
 
             if not os.path.exists(sdir):
                 os.makedirs(sdir)
@@ -82,7 +93,14 @@ def main():
                 fname=instance.get("Filename")
                 oname=os.path.join(sdir, os.path.basename(fname))
                 if not os.path.exists(oname):
-                    os.symlink(fname, oname)
+                    if is_member(fname):
+                        extracts.append((fname, oname))
+                    else:
+                        os.symlink(fname, oname)
+
+    if len(extracts) > 0:
+        logger.info("Extracting %i files from archives" % len(extracts))
+        extract_members(extracts)
 
     return(0)
 
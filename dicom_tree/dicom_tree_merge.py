@@ -0,0 +1,130 @@
+import sys
+import os
+import argparse
+from datetime import datetime
+import logging
+
+try:
+    from .tree_io import load_tree, save_tree
+    from .series_common import COMMON, series_instances
+except ImportError:
+    from tree_io import load_tree, save_tree
+    from series_common import COMMON, series_instances
+
+def get_uid(node, name):
+    return node[name]["Value"][0]
+
+class TreeMerger:
+    """
+    Merges trees into one tree by StudyInstanceUID, SeriesInstanceUID and
+    SOPInstanceUID. Studies, series and instances keep the order they are
+    first seen in, and the first copy of each is kept, as when scanning.
+    Series 'Common' blocks are filled back into their instances.
+    """
+
+    def __init__(self):
+        self.studies = []           # merged list of studies
+        self.directories = []       # 'Directory' of each tree, without repeats
+        self.n_duplicates = 0       # instances found in more than one tree
+
+        self.study_map = {}         # StudyInstanceUID -> study
+        self.series_map = {}        # (study, series) UIDs -> series
+        self.instance_keys = set()  # (study, series, instance) UIDs
+
+    def add_tree(self, tree):
+        directory = tree.get("Directory")
+        if directory not in self.directories:
+            self.directories.append(directory)
+
+        for study in tree["StudyList"]:
+            self.add_study(study)
+
+    def add_study(self, study):
+        study_uid = get_uid(study, "StudyInstanceUID")
+        out_study = self.study_map.get(study_uid)
+        if out_study is None:
+            out_study = {k: v for k, v in study.items() if k != "SeriesList"}
+            out_study["SeriesList"] = []
+            self.study_map[study_uid] = out_study
+            self.studies.append(out_study)
+
+        for series in study["SeriesList"]:
+            self.add_series(out_study, study_uid, series)
+
+    def add_series(self, out_study, study_uid, series):
+        series_uid = get_uid(series, "SeriesInstanceUID")
+        out_series = self.series_map.get((study_uid, series_uid))
+        if out_series is None:
+            out_series = {k: v for k, v in series.items() if k not in ("InstanceList", COMMON)}
+            out_series["InstanceList"] = []
+            self.series_map[(study_uid, series_uid)] = out_series
+            out_study["SeriesList"].append(out_series)
+
+        # Series may differ in their 'Common' blocks, so instances are merged with theirs filled in,
+        # each with its own copy of the entries (see resolve_instance())
+        for instance in series_instances(series):
+            key = (study_uid, series_uid, get_uid(instance, "SOPInstanceUID"))
+            if key in self.instance_keys:
+                self.n_duplicates += 1
+                continue
+            self.instance_keys.add(key)
+            out_series["InstanceList"].append(instance)
+
+    def merged_tree(self):
+        tree = {}
+        if len(self.directories)==1:
+            tree["Directory"] = self.directories[0]
+        else:
+            tree["Directory"] = self.directories
+        tree["StudyList"] = self.studies
+        return tree
+
+def main():
+
+    my_parser = argparse.ArgumentParser(description='Merge dicom trees, e.g. from dicom_tree.py --shard')
+    my_parser.add_argument('-t', '--trees', type=str, nargs='+', help='tree files to merge', required=True)
+    my_parser.add_argument('-o', '--output', type=str, help='merged tree file', required=True)
+    args = my_parser.parse_args()
+
+    slurminfo=''
+    slurmtask=os.environ.get('SLURM_ARRAY_TASK_ID')
+    slurmid=os.environ.get('SLURM_JOB_ID')
+    if slurmid is not None:
+        slurminfo="- SLURM="+slurmid
+        if slurmtask is not None:
+            slurminfo = slurminfo+"_"+slurmtask
+
+    formatter = logging.Formatter(fmt=f'%(asctime)s %(name)s %(levelname)-8s %(message)s {slurminfo}', datefmt='%Y-%m-%d %H:%M:%S')
+    logger = logging.getLogger("dicom_tree_merge")
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    start = datetime.now()
+
+    # Trees are read one at a time so only the merged tree is held in memory
+    merger = TreeMerger()
+    for tree_file in args.trees:
+        if not os.path.exists(tree_file):
+            logger.error("Tree file does not exist: "+tree_file)
+            return(1)
+        logger.info("Reading tree file: "+tree_file)
+        merger.add_tree(load_tree(tree_file))
+
+    if len(merger.directories) > 1:
+        logger.warning("Trees are from %i different directories" % len(merger.directories))
+    if merger.n_duplicates > 0:
+        logger.info("Skipped %i duplicate instances" % merger.n_duplicates)
+
+    logger.info("Merged %i trees: %i studies, %i series, %i instances" %
+        (len(args.trees), len(merger.study_map), len(merger.series_map), len(merger.instance_keys)))
+    logger.info("Merge time: %s" % str(datetime.now()-start))
+
+    logger.info("Writing to: "+args.output)
+    save_tree(merger.merged_tree(), args.output)
+
+    return(0)
+
+if __name__=="__main__":
+    sys.exit(main())
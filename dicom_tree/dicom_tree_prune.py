@@ -4,6 +4,19 @@ import argparse
 import logging
 import json
 
+try:
+    from .tree_io import load_tree, save_tree
+    from .tree_index import write_index
+    from .instance_columns import compact_tree, first_values, select_rows
+    from .series_common import series_first_values, series_tag_entries
+    from .tree_filter import compile_check
+except ImportError:
+    from tree_io import load_tree, save_tree
+    from tree_index import write_index
+    from instance_columns import compact_tree, first_values, select_rows
+    from series_common import series_first_values, series_tag_entries
+    from tree_filter import compile_check
+
 def longest_identical_sequence_indices(lst, tolerance=None):
     """Finds the indices of the longest sequence of identical values in a list.
 
@@ -115,160 +128,34 @@ def longest_consecutive_sequences(nums, first=False):
     return longest_chains
 
 
-def get_tag(struct, check):
-    return( struct.get(check.get('Name')) )
-
-def check_tag(struct, check, verbose=False):
-
-    tag = get_tag(struct, check)
-
-    # Check for existence conditions
-    if check.get('Operator')=='dne':
-        result = tag is None
-        #if verbose and not result:
-        #    print("Failed check for does not exist of tag: "+str(check.get('Name')))
-        return(result)
-    elif check.get('Operator')=='exists':
-        result = tag is not None
-        #if verbose and not result:
-        #    print("Failed check for existence of tag: "+str(check.get('Name'))) 
-        return(result)
-
-    # If tag does not exist, return false or default
-    if tag is None:
-        if check.get('Default') is not None:
-            return(check.get('Default'))
-        return(False)
-    
-    if 'Value' not in tag:
-        if check.get('Default') is not None:
-            return(check.get('Default'))
-        return(False)
-
-    # Get value of tag in struct
-    tag_val = tag.get('Value')
-    if tag_val is None:
-        return(False)
-
-    # Get value from a sequence
-    if 'SeqKey' in check:
-        if check.get('SeqKey') not in tag_val[0].keys():
-            #if verbose:
-            #    print("Failed check for sequence key: "+str(check.get('SeqKey')))
-            return(False)
-        tag_val = tag_val[0].get(check.get('SeqKey'))['Value']
-
-    idx = check.get('Index')
-    if idx is None:
-        idx=0
-
-    if idx >= len(tag_val):
-        if check.get('Default') is not None:
-            return(check.get('Default'))
-        if verbose:
-            print("Failed check for index: "+str(idx)+" of tag: "+str(check.get('Name')))
-        return(False)
-
-    tag_val=tag_val[idx]
-
-    val_type = check.get('Type')
-    if val_type=='str':
-        tag_val=str(tag_val)
-    if val_type=='int':
-        tag_val=int(tag_val)
-    if val_type=='float':
-        tag_val=float(tag_val)
-
-
-    valid_value = check_value(tag_val, check, verbose)
-    #if verbose and not valid_value:
-    #    print("Failed check for value: "+str(tag_val)+" of tag: "+str(check.get('Name')))
-    return(valid_value)
-
-def check_value(value, check, verbose=False):
-
-    # "dne" and "exists" are handled in check_tag
-
-    valid=True
-    if check.get('Operator')=='eq':
-        check_value = check.get('Value')
-        valid = check_value==value
-    elif check.get('Operator')=='ne':
-        check_value = check.get('Value')
-        valid = check_value != value
-    elif check.get("Operator")=="gt":
-        check_value = check.get("Value")
-        valid = value > check_value
-    elif check.get("Operator")=="lt":
-        check_value = check.get("Value")
-        valid = value < check_value
-    elif check.get("Operator")=="ge":
-        check_value = check.get("Value")
-        valid = value >= check_value    
-    elif check.get("Operator")=="le":
-        check_value = check.get("Value")
-        valid = value <= check_value
-    elif check.get("Operator")=="in":
-        check_value = check.get("Value")
-        valid = value in check_value
-    elif check.get("Operator")=="not_in":
-        check_value = check.get("Value")
-        valid = value not in check_value
-    elif check.get("Operator")=="like":
-        check_value = check.get("Value")
-        valid = check_value.upper() in value.upper()
-    elif check.get("Operator")=="not_like":
-        check_value = check.get("Value")
-        valid = not check_value.upper() in value.upper()
-    else:
-        #logging.error("Unknown operator: "+str(check.get("Operator")))
-        valid=False
-
-    return(valid)
-
 def contiguous_series(tree, logger=None):
     for study in tree['StudyList']:
         for series in study["SeriesList"]:
-            inst_list=[]
-            position_list=[]
-            if len(series["InstanceList"]) > 2:
-
-                for instance in series["InstanceList"]:
-                    if "InstanceNumber" in instance:
-                        inst_list.append(instance["InstanceNumber"]["Value"][0])
-                    if "SliceLocation" in instance:
-                        position_list.append(instance["SliceLocation"]["Value"][0])
-
-                inst_num_consecutive = longest_consecutive_sequences(inst_list, first=True)
-                inst_consecutive=[]
-                for instance in series["InstanceList"]:
-                    if "InstanceNumber" in instance:
-                        if instance["InstanceNumber"]["Value"][0] in inst_num_consecutive:
-                            inst_consecutive.append(instance)   
+            instances = series["InstanceList"]
+            if len(instances) > 2:
+
+                inst_nums = series_first_values(series, "InstanceNumber")
+                inst_list = [x for x in inst_nums if x is not None]
+
+                inst_num_consecutive = set(longest_consecutive_sequences(inst_list, first=True))
+                inst_consecutive = [i for i, x in enumerate(inst_nums) if x is not None and x in inst_num_consecutive]
 
                 position_inst_consecutive=inst_consecutive
                 if len(inst_consecutive) > 2:
-                    
-                    position_list=[]
-                    for instance in inst_consecutive:
-                        if "SliceLocation" in instance:
-                            position_list.append(instance["SliceLocation"]["Value"][0])
 
+                    positions = series_first_values(series, "SliceLocation")
+                    position_list = [positions[i] for i in inst_consecutive if positions[i] is not None]
+
+                    # Without every SliceLocation, keep the consecutive instance numbers
                     if len(position_list) != len(inst_consecutive):
                         if logger is not None:
-                            logger.WARNING("Instance/s are missing SliceLocation in series: "+str(series["SeriesNumber"]["Value"][0]))
-                            #print("WARNING: Instance/s are missing SliceLocation in series: "+str(series["SeriesNumber"]["Value"][0]))
-                        series["InstanceList"]=[]
+                            logger.warning("Instance/s are missing SliceLocation in series: "+str(series["SeriesNumber"]["Value"][0]))
                     else:
                 
-                        position_consecutive = longest_evenly_spaced_sequences(position_list)
-                        position_inst_consecutive=[]
-                        for instance in inst_consecutive:
-                            if "SliceLocation" in instance:
-                                if instance["SliceLocation"]["Value"][0] in position_consecutive:
-                                    position_inst_consecutive.append(instance)          
+                        position_consecutive = set(longest_evenly_spaced_sequences(position_list))
+                        position_inst_consecutive = [i for i in inst_consecutive if positions[i] in position_consecutive]
 
-                    series["InstanceList"]=position_inst_consecutive
+                    series["InstanceList"]=select_rows(instances, position_inst_consecutive)
 
     return(tree)
 
@@ -281,6 +168,9 @@ def main():
     my_parser.add_argument('-o', '--output', type=str, help='filtered dicom tree', required=True)
     my_parser.add_argument('-v', '--verbose', action='store_true', help='verbose output', required=False, default=False)
     my_parser.add_argument('-c', '--contiguous', action='store_true', help='only keep contiguous instances', default=False, required=False)
+    my_parser.add_argument('--compact', action='store_true', help='write json without indentation or spaces', default=False, required=False)
+    my_parser.add_argument('--index', action='store_true', help='also write an sqlite index of the output (OUTPUT.sqlite) for dicom_tree_get.py', default=False, required=False)
+    my_parser.add_argument('--columnar', action='store_true', help='store instance lists by column to reduce memory', default=False, required=False)
     args = my_parser.parse_args()
 
     slurminfo=''
@@ -310,172 +200,118 @@ def main():
         logger.error("Tree file does not exist: "+args.tree)
         return(1)
     
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    tree = load_tree(args.tree)
+    if args.columnar:
+        tree = compact_tree(tree)
 
     if args.contiguous:
         tree = contiguous_series(tree)
 
     if args.filter is None:
         logger.warning("No filter file provided, output==input")
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(tree, f, ensure_ascii=False, indent=4)
+        save_tree(tree, args.output, args.compact)
+        if args.index:
+            logger.info("Writing index: "+write_index(args.output))
         return(0)
 
     logger.info("Reading filter file: %s" % args.filter)
     filter_file = open(args.filter)
     filter = json.load(filter_file)
 
-    out_studies = []
-    out_series_map = {}
-    out_instance_map = {}
+    # Each check is compiled once, see tree_filter.py
+    study_checks = [(check, compile_check(check)) for check in filter.get('Study', [])]
+    series_checks = [(check, compile_check(check, args.verbose)) for check in filter.get('Series', [])]
+    instance_checks = [(check, compile_check(check)) for check in filter.get('Instance', [])]
 
-    study_ids=[]
-    for study_id, study in enumerate(tree['StudyList']):
+    # Studies, series and instances are decided in one pass over the tree,
+    # a series is copied as soon as its instances are known
+    n_studies=0
+    n_series=0
+    tree_studies=[]
+    for study in tree['StudyList']:
         #print("Check accession: "+str(study.get("AccessionNumber").get("Value")[0]))
         #print("Check study: "+str(study.get("StudyInstanceUID").get("Value")[0]))
-        study_uid = study.get("StudyInstanceUID").get("Value")[0]
         keep_study=True
-        if 'Study' in filter:
-            for check in filter['Study']:
-                keep_study=keep_study and check_tag(study, check)
-                if args.verbose:
-                    if not keep_study:
-                        logger.debug("Study Failed check: "+str(check))
-                        logger.debug(study.get(check.get('Name')))
-                    else:
-                        logger.debug("Study Passed check: "+str(check))
-                        logger.debug(study.get(check.get('Name')))
-
-        if keep_study:
-            out_studies.append(study_uid)
-
-    logger.debug("Done checking studies")
-    if args.verbose:
-        #print(str(len(out_studies))+" studies passed Study-Level check")
-        logger.info(str(len(out_studies))+" studies passed Study-Level check")
-
-    n_series=0
-    for study in tree.get('StudyList'):
-        study_uid = study.get("StudyInstanceUID").get("Value")[0]
-        if study_uid not in out_studies:
-            continue 
+        for check, passes in study_checks:
+            keep_study=keep_study and passes(study)
+            if args.verbose:
+                if not keep_study:
+                    logger.debug("Study Failed check: "+str(check))
+                    logger.debug(study.get(check.get('Name')))
+                else:
+                    logger.debug("Study Passed check: "+str(check))
+                    logger.debug(study.get(check.get('Name')))
+
+        if not keep_study:
+            continue
+        n_studies+=1
 
-        series_ids=[]
+        series_list=[]
         for series in study['SeriesList']:
 
             #print("Check series:  "+str(series.get("SeriesInstanceUID").get("Value")[0]))
             if args.verbose:
                 logger.info("Check series#: "+str(series.get("SeriesNumber").get("Value")[0]))
 
-            series_uid = series.get("SeriesInstanceUID").get("Value")[0]
             keep_series=True
-            if 'Series' in filter:
-                for check in filter['Series']:
-                    check_result =  check_tag(series, check, args.verbose)
-                    if not check_result and args.verbose:
-                        logger.info(series.get(check.get('Name')) + " Failed check: "+ str(check))
-                        #print("Failed check: "+str(check))
-                        #print(series.get(check.get('Name')))
-
-                    keep_series = keep_series and check_result
-                    if not keep_series and args.verbose:
-                        logger.info(series.get(check.get('Name')) + " Failed check: "+ str(check))
-                        #print("Failed check: "+str(check))
-                        #print(series.get(check.get('Name')))
+            for check, passes in series_checks:
+                check_result =  passes(series)
+                if not check_result and args.verbose:
+                    logger.info(series.get(check.get('Name')) + " Failed check: "+ str(check))
+
+                keep_series = keep_series and check_result
+                if not keep_series and args.verbose:
+                    logger.info(series.get(check.get('Name')) + " Failed check: "+ str(check))
 
             if args.verbose and not keep_series:
                 logger.info("Series Failed check: "+str(series.get("SeriesNumber").get("Value")[0]))
             else:
                 logger.info("Series Passed check: "+str(series.get("SeriesNumber").get("Value")[0]))
 
-            if keep_series:
-                series_ids.append(series_uid)
-
-        if len(series_ids)>0:
-            out_series_map[study_uid]=series_ids              
-    logger.debug("Done checking series")
-
-    #print(out_series_map)
-    if args.verbose:
-        logger.info(str(len(out_series_map.values()))+" series passed Series-Level check")
-        logger.info(out_series_map.values())
-
-    n_instances=0
-    for study in tree.get('StudyList'):
-        study_uid = study.get("StudyInstanceUID").get("Value")[0]
-        if study_uid not in out_studies:
-            continue
-
-        if study_uid not in out_series_map:
-            continue
-
-        for series in study.get("SeriesList"):
-            series_uid = series.get("SeriesInstanceUID").get("Value")[0]
-            if series_uid not in out_series_map[study_uid]:
+            if not keep_series:
                 continue
-
-            instance_ids=[]
-            for instance in series['InstanceList']:
-                keep_instance=True
-                instance_uid = instance.get("SOPInstanceUID").get("Value")[0]
+            n_series+=1
+
+            instances = series['InstanceList']
+            keep_instances = [True]*len(instances)
+
+            # Each check is run down the whole column of its tag
+            for check, passes in instance_checks:
+                name = check.get('Name')
+                for i, entry in enumerate(series_tag_entries(series, name)):
+                    check_result = passes({name: entry})
+                    keep_instances[i] = keep_instances[i] and check_result
+                    if args.verbose:
+                        if not check_result:
+                            logger.info(str(entry) + " Failed check: "+ str(check))
+
+            # Every row with a kept SOPInstanceUID is kept, as are its duplicates
+            instance_uids = first_values(instances, "SOPInstanceUID")
+            keep_uids = set()
+            n_kept=0
+            for instance_uid, keep_instance in zip(instance_uids, keep_instances):
                 logger.debug(" SOPInstanceUID: "+instance_uid)
-                if 'Instance' in filter:
-                    for check in filter['Instance']:
-                        check_result = check_tag(instance, check)
-                        keep_instance = keep_instance and check_result
-                        if args.verbose:
-                            if not check_result:
-                                logger.info(series.get(check.get('Name')) + " Failed check: "+ str(check))
-                                #print("Failed check: "+str(check))
-                                #print(instance.get(check.get('Name')))
-
                 if keep_instance:
-                    instance_ids.append(instance_uid)
-                    n_instances+=1
-
-            if len(instance_ids) >= args.min_instances:
-                out_instance_map[series_uid]=instance_ids
+                    keep_uids.add(instance_uid)
+                    n_kept+=1
 
-    logger.debug("Done checking instances")
-    #print(str(n_instances)+" instances passed Instance-Level check")
-
-    tree_studies=[]
-
-    for study in tree.get('StudyList'):
-        study_uid = study.get("StudyInstanceUID").get("Value")[0]
-
-        if study_uid not in out_series_map:
-            continue
+            if n_kept < args.min_instances:
+                continue
 
-        if study_uid in out_studies:
+            rows = [i for i, uid in enumerate(instance_uids) if uid in keep_uids]
+            if len(rows)>0:
+                series_copy = series.copy()
+                series_copy['InstanceList'] = select_rows(instances, rows)
+                series_list.append(series_copy)
 
-            #print("Scan study: "+str(study_uid))
+        if len(series_list)>0:
             study_copy = study.copy()
-            study_copy['SeriesList']=[]
-
-            for series in study.get("SeriesList"):
-                series_uid = series.get("SeriesInstanceUID").get("Value")[0]
-                if series_uid in out_series_map[study_uid] and series_uid in out_instance_map:
-                    #print("Scan series: "+str(series_uid))
-                    series_copy = series.copy()
-                    series_copy['InstanceList']=[]
-
-                    for instance in series['InstanceList']:
-                        instance_uid = instance.get("SOPInstanceUID").get("Value")[0]
-                        
-                        if instance_uid in out_instance_map[series_uid]:
-                            #print("Keep instance: "+str(instance_uid))
-                            series_copy['InstanceList'].append(instance)
-
-                    if len(series_copy['InstanceList'])>0:
-                        #print("Keep series: "+str(series_uid))
-                        study_copy['SeriesList'].append(series_copy)
-
-            if len(study_copy['SeriesList'])>0:
-                #print("Keep study: "+str(study_uid))
-                tree_studies.append(study_copy)
+            study_copy['SeriesList']=series_list
+            tree_studies.append(study_copy)
 
+    if args.verbose:
+        logger.info(str(n_studies)+" studies passed Study-Level check")
+        logger.info(str(n_series)+" series passed Series-Level check")
 
     out_tree={'Directory': tree['Directory'], 'StudyList': []}
     if len(tree_studies) > 0:
@@ -483,9 +319,10 @@ def main():
     else:
         logger.info("Empty output")
 
-    with open(args.output, 'w', encoding='utf-8') as f:
-        logger.info("Writing pruned tree to: "+args.output)
-        json.dump(out_tree, f, ensure_ascii=False, indent=4)
+    logger.info("Writing pruned tree to: "+args.output)
+    save_tree(out_tree, args.output, args.compact)
+    if args.index:
+        logger.info("Writing index: "+write_index(args.output))
 
     return(0)
 
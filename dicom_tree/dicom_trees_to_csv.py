@@ -11,6 +11,13 @@ from datetime import datetime
 import logging
 import json
 
+try:
+    from .tree_reader import iter_tree
+    from .series_common import resolve_instance
+except ImportError:
+    from tree_reader import iter_tree
+    from series_common import resolve_instance
+
 def get_tag(struct, check):
     el = check.get('Group')+check.get('Element')
     return( struct.get(el) )
@@ -70,11 +77,13 @@ def main():
     for tree in args.trees:
 
         logging.info("Reading tree file: %s" % tree)
-        tree_file = open(tree)
-        tree = json.load(tree_file)
 
-        for study in tree['StudyList']:
-            for series in study['SeriesList']:
+        # Series are read one at a time
+        for event, node, count in iter_tree(tree):
+            if event=="study":
+                study=node
+            if event=="series":
+                series=node
                 row={}
                 for study_key in key['Study']:
                     if study_key in study:
@@ -88,9 +97,10 @@ def main():
                     else:
                         row[series_key] = "NA"
                 
+                instance = resolve_instance(series.get('Common'), series['InstanceList'][0])
                 for instance_key in key['Instance']:
-                    if instance_key in series['InstanceList'][0]:
-                        row[instance_key] = get_value(series['InstanceList'][0], instance_key, index=None)
+                    if instance_key in instance:
+                        row[instance_key] = get_value(instance, instance_key, index=None)
                     else:
                         row[instance_key] = "NA"
 
@@ -11,6 +11,13 @@ from datetime import datetime
 import logging
 import json
 
+try:
+    from .tree_io import load_tree, save_tree
+    from .series_common import resolve_instance
+except ImportError:
+    from tree_io import load_tree, save_tree
+    from series_common import resolve_instance
+
 def get_tag(struct, check):
     el = check.get('Group')+check.get('Element')
     return( struct.get(el) )
@@ -45,8 +52,7 @@ def main():
     args = my_parser.parse_args()
 
     logging.info("Reading tree file: %s" % args.tree)
-    tree_file = open(args.tree)
-    tree = json.load(tree_file)
+    tree = load_tree(args.tree)
 
     logging.info("Reading filter file: %s" % args.filter)
     filter_file = open(args.filter)
@@ -104,7 +110,7 @@ def main():
                 if 'Instance' in filter:
                     for instance in series['InstanceList']:
                         for check in filter['Instance']:
-                            if check_tag(instance, check):
+                            if check_tag(resolve_instance(series.get('Common'), instance), check):
                                 series_copy['InstanceList'].append(instance)
                                 print( "    "+str(len(series_copy['InstanceList'])))
 
@@ -118,8 +124,7 @@ def main():
 
     if len(out_studies) > 0:
         out_tree={'Directory': tree['Directory'], 'StudyList': out_studies}
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(out_tree, f, ensure_ascii=False, indent=4)
+        save_tree(out_tree, args.output)
 
     return(0)
 
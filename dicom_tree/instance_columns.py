@@ -0,0 +1,274 @@
+import json
+from array import array
+
+# Instance lists in a tree are lists of dicts, where every tag entry repeats
+# its Group, Element and vr. InstanceColumns stores the same list by column:
+# the entry metadata is kept once per tag, single numbers are kept in typed
+# arrays, and other values are kept once per distinct value with an array of
+# indices. It behaves like a read-only list of instance dicts, so code that
+# iterates an 'InstanceList' works with either form.
+
+_ENTRY_KEYS = ("Group", "Element", "vr", "Value")
+
+class _Column:
+
+    def __init__(self, meta, kind, n_rows):
+        self.meta = meta        # (Group, Element, vr) shared by all rows, None for a raw column
+        self.kind = kind        # 'int', 'float', 'str', 'json' or 'raw'
+        self.values = _empty_values(kind, n_rows)
+        self.table = []         # distinct values of a 'json' column, as json strings
+        self.lookup = {}        # json string -> index in self.table
+
+    def fits(self, entry):
+        if self.meta is None:
+            return True
+        if _entry_meta(entry) != self.meta:
+            return False
+        return self.kind == 'json' or _value_kind(entry["Value"]) == self.kind
+
+    def append(self, entry):
+        if self.kind == 'raw':
+            self.values.append(entry)
+        elif self.kind == 'json':
+            self.values.append(self._value_id(entry["Value"]))
+        else:
+            self.values.append(entry["Value"][0])
+
+    def _value_id(self, value):
+        key = json.dumps(value, ensure_ascii=False)
+        value_id = self.lookup.get(key)
+        if value_id is None:
+            value_id = len(self.table)
+            self.table.append(key)
+            self.lookup[key] = value_id
+        return value_id
+
+    def append_missing(self):
+        self.values.append(_filler(self.kind))
+
+    def get(self, row):
+        if self.kind == 'raw':
+            return self.values[row]
+        return dict(zip(_ENTRY_KEYS, self.meta+(self.value(row),)))
+
+    def value(self, row):
+        if self.kind == 'raw':
+            if isinstance(self.values[row], dict):
+                return self.values[row].get("Value")
+            return None
+        if self.kind == 'json':
+            if self.values[row] < 0:
+                return None
+            return json.loads(self.table[self.values[row]])
+        return [self.values[row]]
+
+    # Change to a column type that can hold any entry, keeping the values
+    def widen(self, n_rows, raw):
+        entries = [self.get(i) for i in range(n_rows)]
+        self.table = []
+        self.lookup = {}
+        if raw:
+            self.meta = None
+            self.kind = 'raw'
+            self.values = entries
+        else:
+            self.kind = 'json'
+            self.values = array('l', [self._value_id(e["Value"]) for e in entries])
+
+def _empty_values(kind, n_rows):
+    if kind == 'int':
+        return array('q', [0]*n_rows)
+    if kind == 'float':
+        return array('d', [0.0]*n_rows)
+    if kind == 'json':
+        return array('l', [-1]*n_rows)
+    return [_filler(kind)]*n_rows
+
+def _filler(kind):
+    if kind == 'int':
+        return 0
+    if kind == 'float':
+        return 0.0
+    if kind == 'str':
+        return ""
+    if kind == 'json':
+        return -1
+    return None
+
+def _entry_meta(entry):
+    if type(entry) is not dict or tuple(entry.keys()) != _ENTRY_KEYS:
+        return None
+    return (entry["Group"], entry["Element"], entry["vr"])
+
+def _value_kind(value):
+    if type(value) is list and len(value)==1:
+        if type(value[0]) is int and -2**63 <= value[0] < 2**63:
+            return 'int'
+        if type(value[0]) is float:
+            return 'float'
+        if type(value[0]) is str:
+            return 'str'
+    return 'json'
+
+class InstanceColumns:
+
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = {}           # key -> _Column
+        self.key_orders = []        # distinct key orders of the instances
+        self._key_order_ids = {}    # key order -> index in self.key_orders
+        self.row_key_order = array('l')   # index into self.key_orders for each row
+
+    @classmethod
+    def from_instances(cls, instances):
+        columns = cls()
+        for instance in instances:
+            columns.append(instance)
+        return columns
+
+    def append(self, instance):
+        keys = tuple(instance.keys())
+        order_id = self._key_order_ids.get(keys)
+        if order_id is None:
+            order_id = len(self.key_orders)
+            self.key_orders.append(keys)
+            self._key_order_ids[keys] = order_id
+        self.row_key_order.append(order_id)
+
+        for key in keys:
+            entry = instance[key]
+            column = self.columns.get(key)
+            if column is None:
+                meta = _entry_meta(entry)
+                if meta is None:
+                    column = _Column(None, 'raw', self.n_rows)
+                else:
+                    column = _Column(meta, _value_kind(entry["Value"]), self.n_rows)
+                self.columns[key] = column
+            elif not column.fits(entry):
+                column.widen(self.n_rows, raw=_entry_meta(entry) != column.meta)
+            column.append(entry)
+
+        for key, column in self.columns.items():
+            if len(column.values) == self.n_rows:
+                column.append_missing()
+
+        self.n_rows += 1
+
+    def has(self, row, key):
+        return key in self.key_orders[self.row_key_order[row]]
+
+    def instance(self, row):
+        return {key: self.columns[key].get(row) for key in self.key_orders[self.row_key_order[row]]}
+
+    def entries(self, key):
+        """
+        Gets one tag for every instance.
+
+        Args:
+            key: The tag name, as used in the instance dicts.
+
+        Returns:
+            A list with the entry dict of each instance, or None where the instance does not have the tag.
+        """
+
+        column = self.columns.get(key)
+        if column is None:
+            return [None]*self.n_rows
+        return [column.get(i) if self.has(i, key) else None for i in range(self.n_rows)]
+
+    def first_values(self, key):
+        column = self.columns.get(key)
+        if column is None:
+            return [None]*self.n_rows
+
+        values = []
+        for i in range(self.n_rows):
+            value = column.value(i) if self.has(i, key) else None
+            values.append(value[0] if value else None)
+        return values
+
+    def select(self, rows):
+        return InstanceColumns.from_instances(self.instance(i) for i in rows)
+
+    def to_instances(self):
+        return [self.instance(i) for i in range(self.n_rows)]
+
+    def __len__(self):
+        return self.n_rows
+
+    def __iter__(self):
+        for i in range(self.n_rows):
+            yield self.instance(i)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.instance(i) for i in range(self.n_rows)[row]]
+        if row < 0:
+            row += self.n_rows
+        if row < 0 or row >= self.n_rows:
+            raise IndexError("instance index out of range")
+        return self.instance(row)
+
+# The helpers below take an 'InstanceList' in either form
+
+def tag_entries(instances, key):
+    if isinstance(instances, InstanceColumns):
+        return instances.entries(key)
+    return [instance.get(key) for instance in instances]
+
+def first_values(instances, key):
+    """
+    Gets the first value of one tag for every instance.
+
+    Args:
+        instances: A list of instance dicts or an InstanceColumns.
+        key: The tag name, as used in the instance dicts.
+
+    Returns:
+        A list with Value[0] of each instance, or None where the instance does not have the tag.
+    """
+
+    if isinstance(instances, InstanceColumns):
+        return instances.first_values(key)
+
+    values = []
+    for instance in instances:
+        value = None
+        if key in instance and instance[key].get("Value"):
+            value = instance[key]["Value"][0]
+        values.append(value)
+    return values
+
+def select_rows(instances, rows):
+    if isinstance(instances, InstanceColumns):
+        return instances.select(rows)
+    return [instances[i] for i in rows]
+
+def compact_tree(tree):
+    """
+    Replaces every 'InstanceList' in a tree with an InstanceColumns, in place.
+    """
+
+    for study in tree['StudyList']:
+        for series in study['SeriesList']:
+            if not isinstance(series['InstanceList'], InstanceColumns):
+                series['InstanceList'] = InstanceColumns.from_instances(series['InstanceList'])
+    return tree
+
+def expand_tree(tree):
+    """
+    Replaces every InstanceColumns in a tree with a list of instance dicts, in place.
+    """
+
+    for study in tree['StudyList']:
+        for series in study['SeriesList']:
+            if isinstance(series['InstanceList'], InstanceColumns):
+                series['InstanceList'] = series['InstanceList'].to_instances()
+    return tree
+
+# Used as json.dump(default=...) so a series is expanded only while it is written
+def json_default(obj):
+    if isinstance(obj, InstanceColumns):
+        return obj.to_instances()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -12,6 +12,11 @@ import logging
 import json
 import pandas as pd
 
+try:
+    from .tree_io import load_tree, save_tree
+except ImportError:
+    from tree_io import load_tree, save_tree
+
 
 
 def main():
@@ -21,6 +26,7 @@ def main():
     my_parser.add_argument('-k', '--key', type=str, help='id key file', required=True)
     my_parser.add_argument('-o', '--output', type=str, help='output tree', required=True)
     my_parser.add_argument('-l', '--log', type=str, help='logfile', required=False, default=None)
+    my_parser.add_argument('--compact', action='store_true', help='write json without indentation or spaces', default=False, required=False)
     args = my_parser.parse_args()
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s')
@@ -33,8 +39,7 @@ def main():
         logger.addHandler(fh)
 
     logger.info("Reading input tree file: %s" % args.input)
-    tree_file = open(args.input)
-    tree = json.load(tree_file)
+    tree = load_tree(args.input)
 
     logger.info("Reading input key file: %s" % args.key)
     df=pd.read_csv(args.key)
@@ -92,7 +97,8 @@ def main():
                     series_date = series_date + datetime.timedelta(days=patient_date_shift)
                     series['SeriesDate']['Value'][0] = series_date.strftime('%Y%m%d')
 
-                for instance in series['InstanceList']:
+                # Dates shared by all instances are kept once in the series 'Common' block
+                for instance in [series.get('Common', {})]+list(series['InstanceList']):
                     if 'StudyDate' in instance:
                         study_date = instance['StudyDate']['Value'][0]
                         study_date = datetime.datetime.strptime(study_date, '%Y%m%d')
@@ -104,9 +110,8 @@ def main():
                         series_date = series_date + datetime.timedelta(days=patient_date_shift)
                         instance['SeriesDate']['Value'][0] = series_date.strftime('%Y%m%d')
 
-    with open(args.output, 'w', encoding='utf-8') as f:
-        logger.info("Writing to: "+args.output)
-        json.dump(tree, f, ensure_ascii=False, indent=4)
+    logger.info("Writing to: "+args.output)
+    save_tree(tree, args.output, args.compact)
 
     return(0)
 
@@ -0,0 +1,184 @@
+import copy
+
+try:
+    from .instance_columns import InstanceColumns, tag_entries, first_values
+except ImportError:
+    from instance_columns import InstanceColumns, tag_entries, first_values
+
+# Many instance tags (ImageType, PixelSpacing, SliceThickness, ...) have the
+# same entry for every instance of a series. A series may keep these once in
+# a 'Common' dict, placed before its 'InstanceList', and leave them out of
+# each instance. The accessors below resolve an instance's entries from the
+# instance or from 'Common', so a series reads the same with or without it.
+
+COMMON = "Common"
+
+# Entries that identify an instance are never moved to 'Common'
+INSTANCE_KEYS = ("SOPInstanceUID", "Filename")
+
+def common_entries(instances):
+    """
+    Finds the entries that are identical in every instance.
+
+    Args:
+        instances: A list of instance dicts or an InstanceColumns.
+
+    Returns:
+        A dict of the shared entries, in the key order of the first instance. Empty if there are fewer than 2 instances.
+    """
+
+    if len(instances) < 2:
+        return {}
+
+    common = None
+    for instance in instances:
+        if common is None:
+            common = {k: v for k, v in instance.items() if k not in INSTANCE_KEYS}
+        else:
+            common = {k: v for k, v in common.items() if k in instance and instance[k]==v}
+        if len(common)==0:
+            break
+    return common
+
+def hoist_series(series):
+    """
+    Moves the entries shared by all instances of a series into series['Common'], in place.
+
+    Returns:
+        The number of entries moved.
+    """
+
+    instances = series['InstanceList']
+    common = common_entries(instances)
+    if len(common)==0:
+        return 0
+
+    rows = [{k: v for k, v in instance.items() if k not in common} for instance in instances]
+    if isinstance(instances, InstanceColumns):
+        rows = InstanceColumns.from_instances(rows)
+
+    # Keep 'Common' ahead of the instances when the series is written
+    del series['InstanceList']
+    series.setdefault(COMMON, {}).update(common)
+    series['InstanceList'] = rows
+    return len(common)*len(rows)
+
+def expand_series(series):
+    """
+    Copies series['Common'] back into each instance and removes it, in place.
+    """
+
+    common = series.pop(COMMON, None)
+    if common is None:
+        return series
+
+    instances = series['InstanceList']
+    rows = [resolve_instance(common, instance) for instance in instances]
+    if isinstance(instances, InstanceColumns):
+        rows = InstanceColumns.from_instances(rows)
+    series['InstanceList'] = rows
+    return series
+
+def hoist_tree(tree):
+    """
+    Runs hoist_series() on every series of a tree, in place.
+
+    Returns:
+        The number of instance entries moved to 'Common' blocks.
+    """
+
+    n_moved = 0
+    for study in tree['StudyList']:
+        for series in study['SeriesList']:
+            n_moved += hoist_series(series)
+    return n_moved
+
+def expand_tree(tree):
+    """
+    Runs expand_series() on every series of a tree, in place.
+    """
+
+    for study in tree['StudyList']:
+        for series in study['SeriesList']:
+            expand_series(series)
+    return tree
+
+def copy_entry(entry):
+    """
+    Copies a tag entry with its 'Value' list (and the items of a sequence), so it can be changed in place.
+    """
+
+    if not isinstance(entry, dict):
+        return entry
+    entry = dict(entry)
+    value = entry.get("Value")
+    if entry.get("vr")=="SQ":
+        entry["Value"] = copy.deepcopy(value)
+    elif isinstance(value, list):
+        entry["Value"] = list(value)
+    return entry
+
+def resolve_instance(common, instance):
+    """
+    Gets an instance with the entries of a 'Common' block filled in.
+
+    Args:
+        common: series.get('Common'), may be None.
+        instance: An instance dict from the series.
+
+    Returns:
+        The instance itself if there is nothing to fill in, otherwise a new dict. Entries in the instance take precedence.
+        Each instance gets its own copy of the 'Common' entries, so a tree of resolved instances shares no entries.
+    """
+
+    if not common:
+        return instance
+    resolved = dict(instance)
+    for k, v in common.items():
+        if k not in resolved:
+            resolved[k] = copy_entry(v)
+    return resolved
+
+def series_instances(series):
+    """
+    Iterates the instances of a series with 'Common' entries filled in.
+    """
+
+    common = series.get(COMMON)
+    for instance in series['InstanceList']:
+        yield resolve_instance(common, instance)
+
+# tag_entries() and first_values() for a series, looking in 'Common' for instances without the tag
+
+def series_tag_entries(series, key):
+    entries = tag_entries(series['InstanceList'], key)
+    entry = series.get(COMMON, {}).get(key)
+    if entry is None:
+        return entries
+    return [entry if e is None else e for e in entries]
+
+def series_first_values(series, key):
+    values = first_values(series['InstanceList'], key)
+    entry = series.get(COMMON, {}).get(key)
+    if entry is None or not entry.get("Value"):
+        return values
+    value = entry["Value"][0]
+    return [value if v is None else v for v in values]
+
+def hoisted_copy(tree):
+    """
+    Gets a copy of a tree with 'Common' blocks, see hoist_series(). The copy
+    shares its entries with the tree, which is not changed.
+    """
+
+    studies = []
+    for study in tree['StudyList']:
+        series_list = []
+        for series in study['SeriesList']:
+            series_copy = dict(series)
+            if COMMON in series_copy:
+                series_copy[COMMON] = dict(series_copy[COMMON])
+            hoist_series(series_copy)
+            series_list.append(series_copy)
+        studies.append(dict(study, SeriesList=series_list))
+    return dict(tree, StudyList=studies)
@@ -0,0 +1,260 @@
+# Filters select studies, series and instances by their tags, see
+# data/ct_filter.json. Each of the 'Study', 'Series' and 'Instance' lists
+# holds checks of one tag (by 'Name') and a node is kept if it passes all
+# the checks of its level. Used by dicom_tree_prune.py and by dicom_tree.py
+# to filter while scanning.
+
+def get_tag(struct, check):
+    return( struct.get(check.get('Name')) )
+
+def check_tag(struct, check, verbose=False):
+
+    tag = get_tag(struct, check)
+
+    # Check for existence conditions
+    if check.get('Operator')=='dne':
+        result = tag is None
+        #if verbose and not result:
+        #    print("Failed check for does not exist of tag: "+str(check.get('Name')))
+        return(result)
+    elif check.get('Operator')=='exists':
+        result = tag is not None
+        #if verbose and not result:
+        #    print("Failed check for existence of tag: "+str(check.get('Name'))) 
+        return(result)
+
+    # If tag does not exist, return false or default
+    if tag is None:
+        if check.get('Default') is not None:
+            return(check.get('Default'))
+        return(False)
+    
+    if 'Value' not in tag:
+        if check.get('Default') is not None:
+            return(check.get('Default'))
+        return(False)
+
+    # Get value of tag in struct
+    tag_val = tag.get('Value')
+    if tag_val is None:
+        return(False)
+
+    # Get value from a sequence
+    if 'SeqKey' in check:
+        if check.get('SeqKey') not in tag_val[0].keys():
+            #if verbose:
+            #    print("Failed check for sequence key: "+str(check.get('SeqKey')))
+            return(False)
+        tag_val = tag_val[0].get(check.get('SeqKey'))['Value']
+
+    idx = check.get('Index')
+    if idx is None:
+        idx=0
+
+    if idx >= len(tag_val):
+        if check.get('Default') is not None:
+            return(check.get('Default'))
+        if verbose:
+            print("Failed check for index: "+str(idx)+" of tag: "+str(check.get('Name')))
+        return(False)
+
+    tag_val=tag_val[idx]
+
+    val_type = check.get('Type')
+    if val_type=='str':
+        tag_val=str(tag_val)
+    if val_type=='int':
+        tag_val=int(tag_val)
+    if val_type=='float':
+        tag_val=float(tag_val)
+
+
+    valid_value = check_value(tag_val, check, verbose)
+    #if verbose and not valid_value:
+    #    print("Failed check for value: "+str(tag_val)+" of tag: "+str(check.get('Name')))
+    return(valid_value)
+
+def check_value(value, check, verbose=False):
+
+    # "dne" and "exists" are handled in check_tag
+
+    valid=True
+    if check.get('Operator')=='eq':
+        check_value = check.get('Value')
+        valid = check_value==value
+    elif check.get('Operator')=='ne':
+        check_value = check.get('Value')
+        valid = check_value != value
+    elif check.get("Operator")=="gt":
+        check_value = check.get("Value")
+        valid = value > check_value
+    elif check.get("Operator")=="lt":
+        check_value = check.get("Value")
+        valid = value < check_value
+    elif check.get("Operator")=="ge":
+        check_value = check.get("Value")
+        valid = value >= check_value    
+    elif check.get("Operator")=="le":
+        check_value = check.get("Value")
+        valid = value <= check_value
+    elif check.get("Operator")=="in":
+        check_value = check.get("Value")
+        valid = value in check_value
+    elif check.get("Operator")=="not_in":
+        check_value = check.get("Value")
+        valid = value not in check_value
+    elif check.get("Operator")=="like":
+        check_value = check.get("Value")
+        valid = check_value.upper() in value.upper()
+    elif check.get("Operator")=="not_like":
+        check_value = check.get("Value")
+        valid = not check_value.upper() in value.upper()
+    else:
+        #logging.error("Unknown operator: "+str(check.get("Operator")))
+        valid=False
+
+    return(valid)
+
+# check_tag() and check_value() read the check dict on every call. The
+# compile functions below read it once and return a closure with the same
+# result: the operator, cast, index and default are fixed, 'in' and 'not_in'
+# lists become sets and 'like' operands are uppercased once.
+
+CASTS = {'str': str, 'int': int, 'float': float}
+
+def compile_value(check):
+    """
+    Compiles the operator of a check, see check_value().
+
+    Returns:
+        A function of the (cast) tag value that returns True if it passes.
+    """
+
+    operator = check.get('Operator')
+    value = check.get('Value')
+
+    if operator=='eq':
+        return lambda v: value == v
+    if operator=='ne':
+        return lambda v: value != v
+    if operator=='gt':
+        return lambda v: v > value
+    if operator=='lt':
+        return lambda v: v < value
+    if operator=='ge':
+        return lambda v: v >= value
+    if operator=='le':
+        return lambda v: v <= value
+
+    if operator in ('in', 'not_in'):
+        # A set gives the same answer as the list, except for values that cannot be hashed
+        try:
+            value_set = frozenset(value) if isinstance(value, list) else None
+        except TypeError:
+            value_set = None
+
+        if value_set is None:
+            contains = lambda v: v in value
+        else:
+            def contains(v):
+                try:
+                    return v in value_set
+                except TypeError:
+                    return v in value
+
+        if operator=='in':
+            return contains
+        return lambda v: not contains(v)
+
+    if operator in ('like', 'not_like'):
+        # Other operands fail as in check_value(), when a value is checked
+        if not isinstance(value, str):
+            return lambda v: check_value(v, check)
+        upper = value.upper()
+        if operator=='like':
+            return lambda v: upper in v.upper()
+        return lambda v: upper not in v.upper()
+
+    return lambda v: False
+
+def compile_check(check, verbose=False):
+    """
+    Compiles one check, see check_tag().
+
+    Returns:
+        A function of a study, series or instance dict that returns what check_tag() would.
+    """
+
+    name = check.get('Name')
+    operator = check.get('Operator')
+
+    # Existence checks do not look at the value
+    if operator=='dne':
+        return lambda struct: struct.get(name) is None
+    if operator=='exists':
+        return lambda struct: struct.get(name) is not None
+
+    default = check.get('Default')
+    missing = default if default is not None else False
+    has_seq_key = 'SeqKey' in check
+    seq_key = check.get('SeqKey')
+    idx = check.get('Index')
+    if idx is None:
+        idx = 0
+    cast = CASTS.get(check.get('Type'))
+    test = compile_value(check)
+
+    def passes(struct):
+        tag = struct.get(name)
+        if tag is None or 'Value' not in tag:
+            return missing
+
+        tag_val = tag.get('Value')
+        if tag_val is None:
+            return False
+
+        if has_seq_key:
+            if seq_key not in tag_val[0].keys():
+                return False
+            tag_val = tag_val[0].get(seq_key)['Value']
+
+        if idx >= len(tag_val):
+            if default is not None:
+                return default
+            if verbose:
+                print("Failed check for index: "+str(idx)+" of tag: "+str(name))
+            return False
+
+        tag_val = tag_val[idx]
+        if cast is not None:
+            tag_val = cast(tag_val)
+        return test(tag_val)
+
+    return passes
+
+def compile_checks(checks, verbose=False):
+    """
+    Compiles a list of checks into one function of a study, series or
+    instance dict, which is True if the node passes all of them. It stops
+    at the first check that fails.
+    """
+
+    predicates = [compile_check(check, verbose) for check in checks]
+
+    def passes(struct):
+        for predicate in predicates:
+            if not predicate(struct):
+                return False
+        return True
+
+    return passes
+
+def compile_filter(filter, verbose=False):
+    """
+    Compiles each level of a filter with compile_checks().
+
+    Returns:
+        A dict with a function for each of 'Study', 'Series' and 'Instance' in the filter. Levels missing from the filter are left out.
+    """
+
+    return {level: compile_checks(filter[level], verbose) for level in ('Study', 'Series', 'Instance') if level in filter}
@@ -0,0 +1,149 @@
+import os
+import json
+import sqlite3
+from urllib.request import pathname2url
+
+try:
+    from .tree_reader import iter_tree
+    from .tree_json import dumps_line
+    from .series_common import series_instances
+except ImportError:
+    from tree_reader import iter_tree
+    from tree_json import dumps_line
+    from series_common import series_instances
+
+# A tree file can have an sqlite index next to it ('<tree file>.sqlite')
+# so tools like dicom_tree_get.py can answer queries without parsing the
+# tree. Each study, series and instance is a row numbered in tree order,
+# and every entry of each is a row of the 'tags' table holding the entry
+# as json. The index records the size and mtime of the tree it was built
+# from and is ignored once the tree changes.
+
+INDEX_VERSION = 1
+
+LEVELS = ("study", "series", "instance")
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE studies (study_id INTEGER PRIMARY KEY, study_uid TEXT, n_series INTEGER);
+CREATE TABLE series (series_id INTEGER PRIMARY KEY, study_id INTEGER, series_uid TEXT, n_instances INTEGER);
+CREATE TABLE instances (instance_id INTEGER PRIMARY KEY, series_id INTEGER, instance_uid TEXT, filename TEXT);
+CREATE TABLE tags (level TEXT, node_id INTEGER, name TEXT, entry TEXT);
+"""
+
+_INDEXES = """
+CREATE INDEX tags_level_name ON tags (level, name, node_id);
+CREATE INDEX studies_uid ON studies (study_uid);
+CREATE INDEX series_uid ON series (series_uid);
+CREATE INDEX instances_uid ON instances (instance_uid);
+"""
+
+def index_filename(tree_filename):
+    return str(tree_filename)+".sqlite"
+
+def tree_stamp(tree_filename):
+    st = os.stat(tree_filename)
+    return {"Version": str(INDEX_VERSION), "TreeSize": str(st.st_size), "TreeMTime": str(st.st_mtime_ns)}
+
+def get_uid(node, name):
+    entry = node.get(name)
+    if isinstance(entry, dict) and entry.get("Value"):
+        return entry["Value"][0]
+    return None
+
+def _tag_rows(level, node_id, node, skip=()):
+    for name, entry in node.items():
+        if name not in skip:
+            yield (level, node_id, name, dumps_line(entry))
+
+def write_index(tree_filename):
+    """
+    Builds the sqlite index of a tree file, reading the tree one series at a time.
+
+    Args:
+        tree_filename: A tree file in any format read by load_tree().
+
+    Returns:
+        The name of the index file.
+    """
+
+    filename = index_filename(tree_filename)
+    tmp_name = filename+".tmp"
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+
+    conn = sqlite3.connect(tmp_name)
+    conn.executescript(_SCHEMA)
+
+    study_id = 0
+    series_id = 0
+    instance_id = 0
+    for event, node, count in iter_tree(tree_filename):
+        if event == "study":
+            study_id += 1
+        elif event == "series":
+            series_id += 1
+            conn.execute("INSERT INTO series VALUES (?,?,?,?)",
+                (series_id, study_id, get_uid(node, "SeriesInstanceUID"), count))
+            conn.executemany("INSERT INTO tags VALUES (?,?,?,?)", _tag_rows("series", series_id, node, ("InstanceList", "Common")))
+
+            # Instance tags include those kept in the series 'Common' block
+            for instance in series_instances(node):
+                instance_id += 1
+                conn.execute("INSERT INTO instances VALUES (?,?,?,?)",
+                    (instance_id, series_id, get_uid(instance, "SOPInstanceUID"), instance.get("Filename")))
+                conn.executemany("INSERT INTO tags VALUES (?,?,?,?)", _tag_rows("instance", instance_id, instance))
+        elif event == "end_study":
+            conn.execute("INSERT INTO studies VALUES (?,?,?)", (study_id, get_uid(node, "StudyInstanceUID"), count))
+            conn.executemany("INSERT INTO tags VALUES (?,?,?,?)", _tag_rows("study", study_id, node, ("SeriesList",)))
+
+    conn.executescript(_INDEXES)
+    conn.executemany("INSERT INTO meta VALUES (?,?)", tree_stamp(tree_filename).items())
+    conn.commit()
+    conn.close()
+
+    os.replace(tmp_name, filename)
+    return filename
+
+def open_index(tree_filename):
+    """
+    Opens the sqlite index of a tree file.
+
+    Returns:
+        An sqlite3 connection, or None if there is no index or it was built from a different version of the tree.
+    """
+
+    filename = index_filename(tree_filename)
+    if not os.path.exists(filename) or not os.path.exists(tree_filename):
+        return None
+
+    # The path is escaped, so '?', '#' and '%' in it are not read as parts of the URI
+    conn = None
+    try:
+        conn = sqlite3.connect("file:"+pathname2url(os.path.abspath(filename))+"?mode=ro", uri=True)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.Error:
+        if conn is not None:
+            conn.close()
+        return None
+
+    if meta != tree_stamp(tree_filename):
+        conn.close()
+        return None
+
+    return conn
+
+def count_nodes(conn, level):
+    table = {"study": "studies", "series": "series", "instance": "instances"}[level]
+    return conn.execute("SELECT COUNT(*) FROM "+table).fetchone()[0]
+
+def tag_entries(conn, level, name):
+    """
+    Gets one tag at one level, in tree order.
+
+    Yields:
+        The entry of each study, series or instance that has the tag.
+    """
+
+    for (entry,) in conn.execute("SELECT entry FROM tags WHERE level=? AND name=? ORDER BY node_id", (level, name)):
+        yield json.loads(entry)
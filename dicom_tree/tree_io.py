@@ -0,0 +1,270 @@
+import os
+import json
+import pickle
+import gzip
+
+# zstandard is optional, needed only for '.zst' files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from .instance_columns import InstanceColumns, json_default
+    from .tree_json import dumps_line, dump_tree
+except ImportError:
+    from instance_columns import InstanceColumns, json_default
+    from tree_json import dumps_line, dump_tree
+
+# Tree files are nested json by default. Files ending in '.ndjson' hold one
+# record per line: a header with the top level entries (e.g. Directory)
+# followed by one record per instance. The first instance of each study and
+# series also carries the study/series entries, so the nested tree can be
+# rebuilt in the same order.
+
+# Files ending in '.pkl' or '.pickle' hold the nested tree as a pickle
+# (protocol 5), which loads several times faster than json. Only plain
+# dicts, lists, strings and numbers are read back, so loading a tree
+# cannot run code from the file. Json stays the format for sharing trees.
+
+# Any of these can be compressed by adding '.gz', or '.zst' when zstandard
+# is installed (e.g. 'tree.json.gz', 'tree.ndjson.zst'). Files are read and
+# written through the compressor, so the uncompressed text is never held
+# in memory as a whole.
+
+PICKLE_EXTENSIONS = (".pkl", ".pickle")
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+def strip_compression(filename):
+    filename = str(filename)
+    for ext in (".gz", ".zst"):
+        if filename.endswith(ext):
+            return filename[:-len(ext)]
+    return filename
+
+def is_ndjson(filename):
+    return strip_compression(filename).endswith(".ndjson")
+
+def is_pickle(filename):
+    return strip_compression(filename).endswith(PICKLE_EXTENSIONS)
+
+def open_tree_file(filename, mode='r'):
+    """
+    Opens a tree file, compressed if the name ends in '.gz' or '.zst'.
+
+    Args:
+        filename: The file to open.
+        mode: 'r' or 'w' for utf-8 text, 'rb' or 'wb' for bytes.
+
+    Returns:
+        A file object.
+    """
+
+    filename = str(filename)
+    binary = 'b' in mode
+    encoding = None if binary else 'utf-8'
+
+    if filename.endswith(".gz"):
+        if not binary:
+            mode = mode+'t'
+        return gzip.open(filename, mode, compresslevel=GZIP_LEVEL, encoding=encoding)
+
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("zstandard is needed for: %s" % filename)
+        cctx = None
+        if 'w' in mode:
+            cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return zstandard.open(filename, mode, cctx=cctx, encoding=encoding)
+
+    return open(filename, mode, encoding=encoding)
+
+PLAIN_TYPES = (str, int, float)
+
+class TreePickler(pickle.Pickler):
+
+    # Columnar instance lists are written as plain lists, and subclasses of
+    # str, int and float (e.g. pydicom's UID in a scanned tree) as plain values
+    def reducer_override(self, obj):
+        if isinstance(obj, InstanceColumns):
+            return (list, (obj.to_instances(),))
+        for base in PLAIN_TYPES:
+            if isinstance(obj, base):
+                return (base, (base(obj),))
+        return NotImplemented
+
+class TreeUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        if module == "builtins" and name == "list":
+            return list
+        if module == "builtins" and name in ("str", "int", "float"):
+            return {"str": str, "int": int, "float": float}[name]
+        raise pickle.UnpicklingError("Unexpected object in tree file: %s.%s" % (module, name))
+
+def ndjson_record(study_uid, series_uid, study=None, series=None, instance=None):
+    """
+    Creates one ndjson tree record.
+
+    Args:
+        study_uid: StudyInstanceUID of the instance.
+        series_uid: SeriesInstanceUID of the instance.
+        study: Study level entries (without 'SeriesList') if this is the first record of the study.
+        series: Series level entries (without 'InstanceList') if this is the first record of the series.
+        instance: The instance entries, or None for a series with no instances.
+
+    Returns:
+        A dict that can be written as one line of json.
+    """
+
+    record = {"StudyInstanceUID": study_uid, "SeriesInstanceUID": series_uid}
+    if study is not None:
+        record["Study"] = study
+    if series is not None:
+        record["Series"] = series
+    if instance is not None:
+        record["Instance"] = instance
+    return record
+
+def write_ndjson_record(f, record):
+    f.write(dumps_line(record, default=json_default))
+    f.write("\n")
+
+def tree_to_records(tree):
+    """
+    Converts a nested tree to ndjson records.
+
+    Args:
+        tree: A dict with a 'StudyList'.
+
+    Yields:
+        The header record, then one record per instance.
+    """
+
+    yield {k: v for k, v in tree.items() if k != 'StudyList'}
+
+    for study in tree['StudyList']:
+        study_uid = study["StudyInstanceUID"]["Value"][0]
+        study_entries = {k: v for k, v in study.items() if k != 'SeriesList'}
+
+        # Studies with no series are kept with a record that has no series entries
+        if len(study['SeriesList'])==0:
+            yield {"StudyInstanceUID": study_uid, "Study": study_entries}
+
+        for series in study['SeriesList']:
+            series_uid = series["SeriesInstanceUID"]["Value"][0]
+            series_entries = {k: v for k, v in series.items() if k != 'InstanceList'}
+
+            if len(series['InstanceList'])==0:
+                yield ndjson_record(study_uid, series_uid, study_entries, series_entries)
+                study_entries = None
+
+            for instance in series['InstanceList']:
+                yield ndjson_record(study_uid, series_uid, study_entries, series_entries, instance)
+                study_entries = None
+                series_entries = None
+
+def records_to_tree(records):
+    """
+    Rebuilds a nested tree from ndjson records.
+
+    Args:
+        records: An iterable of records, the first being the header.
+
+    Returns:
+        A dict with the header entries and a 'StudyList'.
+    """
+
+    tree = None
+    studies = {}
+    series_map = {}
+
+    for record in records:
+        if tree is None:
+            tree = dict(record)
+            tree['StudyList'] = []
+            continue
+
+        study_uid = record["StudyInstanceUID"]
+        series_uid = record.get("SeriesInstanceUID")
+
+        if "Study" in record:
+            study = record["Study"]
+            study['SeriesList'] = []
+            tree['StudyList'].append(study)
+            studies[study_uid] = study
+
+        if "Series" in record:
+            series = record["Series"]
+            series['InstanceList'] = []
+            studies[study_uid]['SeriesList'].append(series)
+            series_map[(study_uid, series_uid)] = series
+
+        if "Instance" in record:
+            series_map[(study_uid, series_uid)]['InstanceList'].append(record["Instance"])
+
+    if tree is None:
+        tree = {'StudyList': []}
+
+    return tree
+
+def read_ndjson_records(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def load_tree(filename):
+    """
+    Reads a tree file in either format.
+
+    Args:
+        filename: A nested json tree, an ndjson tree if it ends in '.ndjson', or a pickled tree if it ends in '.pkl' or '.pickle', optionally followed by '.gz' or '.zst'.
+
+    Returns:
+        The nested tree.
+    """
+
+    if is_pickle(filename):
+        with open_tree_file(filename, 'rb') as f:
+            return TreeUnpickler(f).load()
+
+    with open_tree_file(filename) as f:
+        if is_ndjson(filename):
+            return records_to_tree(read_ndjson_records(f))
+        return json.load(f)
+
+def save_tree(tree, filename, compact=False):
+    """
+    Writes a tree file in the format given by the filename, see load_tree().
+
+    Args:
+        tree: A dict with a 'StudyList'.
+        filename: The output file.
+        compact: Write json without indentation or spaces (see tree_json.py).
+    """
+
+    if is_pickle(filename):
+        with open_tree_file(filename, 'wb') as f:
+            TreePickler(f, protocol=5).dump(tree)
+        return
+
+    with open_tree_file(filename, 'w') as f:
+        if is_ndjson(filename):
+            for record in tree_to_records(tree):
+                write_ndjson_record(f, record)
+        else:
+            dump_tree(tree, f, compact, default=json_default)
+
+def replace_tree(tree, filename, compact=False):
+    """
+    Writes a tree file like save_tree(), through a temporary file in the same
+    directory that is then renamed, so readers see either the old or the new tree.
+    """
+
+    # The prefix keeps the extensions that choose the format
+    dirname, basename = os.path.split(filename)
+    tmp_name = os.path.join(dirname, ".tmp_"+basename)
+    save_tree(tree, tmp_name, compact)
+    os.replace(tmp_name, filename)
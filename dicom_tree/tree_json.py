@@ -0,0 +1,161 @@
+import json
+import math
+
+# orjson is optional, it writes json several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Json text for tree files and records. With orjson installed it is used
+# for writing, otherwise the json module is used, and both write the same
+# layout. Either way the text parses to the same objects: orjson writes NaN
+# and Infinity as null and cannot write some values (ints over 64 bits,
+# keys that are not strings), so anything orjson cannot write exactly is
+# written by the json module. Indented text uses INDENT spaces, the only
+# indentation orjson has. Compact text and ndjson lines have no indentation
+# or spaces. Reading always uses the json module, which parses large ints
+# and NaN the way they were written.
+
+INDENT = 2
+
+def _is_finite(obj, default):
+    """
+    Checks that an object holds no NaN or Infinity, which orjson would write as null.
+
+    Args:
+        obj: The object to check, already known to be writable by orjson.
+        default: As in dumps(), used for objects other than json types.
+
+    Returns:
+        False if a float in obj is not finite.
+    """
+
+    # Exact types are checked first, as nearly every value in a tree is one of them
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind is str or kind is int or value is None:
+            continue
+        if kind is dict:
+            stack.extend(value.values())
+        elif kind is list:
+            stack.extend(value)
+        elif kind is float:
+            if not math.isfinite(value):
+                return False
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, float):
+            if not math.isfinite(value):
+                return False
+        elif not isinstance(value, (str, int)) and default is not None:
+            stack.append(default(value))
+    return True
+
+def _orjson_dumps(obj, compact, default):
+    option = 0 if compact else orjson.OPT_INDENT_2
+    try:
+        data = orjson.dumps(obj, default=default, option=option)
+    except TypeError:
+        return None
+
+    # Without a null in the text there is no NaN or Infinity to look for
+    if b"null" in data and not _is_finite(obj, default):
+        return None
+    return data.decode('utf-8')
+
+def dumps(obj, compact=False, default=None):
+    """
+    Converts an object to json text.
+
+    Args:
+        obj: The object to convert.
+        compact: Leave out indentation and spaces.
+        default: Called for objects that are not otherwise serializable, as in json.dumps().
+
+    Returns:
+        The json text, indented by INDENT spaces unless compact.
+    """
+
+    if orjson is not None:
+        text = _orjson_dumps(obj, compact, default)
+        if text is not None:
+            return text
+
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default)
+    return json.dumps(obj, ensure_ascii=False, indent=INDENT, default=default)
+
+def dumps_line(obj, default=None):
+    """
+    Converts an object to json text on one line, e.g. for an ndjson record. Lines are always compact.
+    """
+
+    if orjson is not None:
+        text = _orjson_dumps(obj, True, default)
+        if text is not None:
+            return text
+
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default)
+
+def dump(obj, f, compact=False, default=None):
+    """
+    Writes an object as json text to an open text file, see dumps().
+    """
+
+    f.write(dumps(obj, compact, default))
+
+def dump_tree(tree, f, compact=False, default=None):
+    """
+    Writes a tree one study at a time, so only one study's text is held in memory.
+
+    Args:
+        tree: A dict, usually with a 'StudyList'.
+        f: An open text file.
+        compact: Leave out indentation and spaces.
+        default: See dumps().
+    """
+
+    if len(tree)==0:
+        f.write("{}")
+        return
+
+    if compact:
+        f.write("{")
+        for k, (key, value) in enumerate(tree.items()):
+            if k > 0:
+                f.write(",")
+            f.write(dumps(key, True)+":")
+            if key == "StudyList" and isinstance(value, list):
+                f.write("[")
+                for i, study in enumerate(value):
+                    if i > 0:
+                        f.write(",")
+                    f.write(dumps(study, True, default))
+                f.write("]")
+            else:
+                f.write(dumps(value, True, default))
+        f.write("}")
+        return
+
+    # Nested text is indented by adding the indentation of its level to each line
+    indent = " "*INDENT
+    f.write("{")
+    for k, (key, value) in enumerate(tree.items()):
+        if k > 0:
+            f.write(",")
+        f.write("\n"+indent+dumps(key)+": ")
+        if key == "StudyList" and isinstance(value, list) and len(value) > 0:
+            f.write("[")
+            for i, study in enumerate(value):
+                if i > 0:
+                    f.write(",")
+                f.write("\n"+indent*2+dumps(study, False, default).replace("\n", "\n"+indent*2))
+            f.write("\n"+indent+"]")
+        else:
+            f.write(dumps(value, False, default).replace("\n", "\n"+indent))
+    f.write("\n}")
@@ -0,0 +1,352 @@
+import json
+import re
+
+try:
+    from .tree_io import is_ndjson, is_pickle, load_tree, open_tree_file, read_ndjson_records, records_to_tree
+except ImportError:
+    from tree_io import is_ndjson, is_pickle, load_tree, open_tree_file, read_ndjson_records, records_to_tree
+
+# Reads a tree one study and one series at a time instead of loading the
+# whole file, for tools that only look at a few entries or count things.
+# iter_tree() yields events:
+#
+#   ("study", study, None)           study entries, before its series
+#   ("series", series, n_instances)  a complete series
+#   ("end_study", study, n_series)   after the last series of the study
+#   ("end", header, n_studies)       the top level entries (e.g. Directory)
+#
+# Series and instance lists below the requested depth are skipped, only
+# counting their items, so counting queries never build those dicts.
+
+DEPTHS = ("study", "series", "instance")
+
+_WHITESPACE = re.compile(r'\s*')
+
+# Characters of json checked at a time when skipping an array
+_SKIP_WINDOW = 65536
+
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_SKIP_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
+_NOT_BRACKET = re.compile(r'[^\[\]{}]+')
+
+# Deletes everything that can be outside a json string except brackets
+_KEEP_BRACKETS = str.maketrans("", "", " \t\n\r,:0123456789+-.eEtrufalsnNIiy")
+
+def _brackets(text):
+    """
+    Gets the brackets of json text that are not inside strings.
+
+    Args:
+        text: Json text that does not start inside a string.
+
+    Returns:
+        (brackets, end) where end is the length of text, or the start of a string that runs past the end of text.
+    """
+
+    # Without backslashes every quote starts or ends a string
+    if "\\" not in text:
+        end = len(text)
+        parts = text.split('"')
+        if len(parts) % 2 == 0:
+            end = text.rfind('"')
+            parts.pop()
+        return ("".join(parts[0::2]).translate(_KEEP_BRACKETS), end)
+
+    stripped = _STRING.sub("", text)
+    end = len(text)
+    partial = stripped.find('"')
+    if partial >= 0:
+        stripped = stripped[:partial]
+        end = _partial_string_start(text)
+    return (_NOT_BRACKET.sub("", stripped), end)
+
+# Start of a string that runs past the end of the text, which is the last
+# quote not escaped by a backslash
+def _partial_string_start(text):
+    quote = len(text)
+    while True:
+        quote = text.rfind('"', 0, quote)
+        n_slashes = 0
+        while quote-n_slashes > 0 and text[quote-n_slashes-1] == "\\":
+            n_slashes += 1
+        if n_slashes % 2 == 0:
+            return quote
+
+class JsonTreeReader:
+    """
+    Incremental reader for a nested json tree, holding only a small window of the file.
+    """
+
+    def __init__(self, f, chunk_size=1<<20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    # Read more of the file, dropping the part already parsed
+    def _fill(self):
+        if self.eof:
+            raise ValueError("Unexpected end of tree file")
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:]+data
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected '%s' in tree file" % char)
+        self.pos += 1
+
+    def read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                self._fill()
+                continue
+
+            # A number may continue past the end of the buffer
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+
+            self.pos = end
+            return value
+
+    # Yield the keys of an object, the caller reads each value before the next key
+    def iter_object(self):
+        self._expect("{")
+        first = True
+        while True:
+            if self._peek() == "}":
+                self.pos += 1
+                return
+            if not first:
+                self._expect(",")
+            first = False
+            key = self.read_value()
+            self._expect(":")
+            yield key
+
+    # Yield once per item of an array, the caller reads each item before the next
+    def iter_array(self):
+        self._expect("[")
+        first = True
+        while True:
+            if self._peek() == "]":
+                self.pos += 1
+                return
+            if not first:
+                self._expect(",")
+            first = False
+            yield
+
+    def skip_array(self):
+        """
+        Skips an array of objects without decoding it.
+
+        Returns:
+            The number of objects in the array.
+        """
+
+        self._expect("[")
+        depth = 1
+        count = 0
+        window = _SKIP_WINDOW
+        while True:
+            segment = self.buf[self.pos:self.pos+window]
+            brackets, end = _brackets(segment)
+
+            new_depth = depth
+            new_count = count
+            for char in brackets:
+                if char == "{" or char == "[":
+                    if new_depth == 1 and char == "{":
+                        new_count += 1
+                    new_depth += 1
+                elif char == "}" or char == "]":
+                    new_depth -= 1
+                    if new_depth == 0:
+                        return self._skip_to_end(depth, count)
+                else:
+                    raise ValueError("Unexpected '%s' in tree file" % char)
+
+            depth = new_depth
+            count = new_count
+            self.pos += end
+
+            # No progress means a string runs past the window or the buffer
+            if end == 0:
+                if self.pos+window < len(self.buf):
+                    window *= 2
+                else:
+                    self._fill()
+            elif self.pos >= len(self.buf):
+                self._fill()
+
+    # Find where the array ends in the buffer, starting at the given depth and count
+    def _skip_to_end(self, depth, count):
+        for m in _SKIP_TOKEN.finditer(self.buf, self.pos):
+            char = self.buf[m.start()]
+            if char == "{" or char == "[":
+                if depth == 1 and char == "{":
+                    count += 1
+                depth += 1
+            elif char != '"':
+                depth -= 1
+                if depth == 0:
+                    self.pos = m.end()
+                    return count
+        raise ValueError("Unexpected end of tree file")
+
+    def events(self, depth="instance"):
+        header = {}
+        n_studies = 0
+        for key in self.iter_object():
+            if key == "StudyList":
+                for _ in self.iter_array():
+                    yield from self.study_events(depth)
+                    n_studies += 1
+            else:
+                header[key] = self.read_value()
+
+        yield ("end", header, n_studies)
+
+    def study_events(self, depth):
+        study = {}
+        started = False
+        n_series = 0
+        for key in self.iter_object():
+            if key == "SeriesList":
+                yield ("study", study, None)
+                started = True
+                if depth == "study":
+                    n_series = self.skip_array()
+                else:
+                    for _ in self.iter_array():
+                        yield self.read_series(depth)
+                        n_series += 1
+            else:
+                study[key] = self.read_value()
+
+        if not started:
+            yield ("study", study, None)
+        yield ("end_study", study, n_series)
+
+    def read_series(self, depth):
+        series = {}
+        n_instances = 0
+        for key in self.iter_object():
+            if key == "InstanceList":
+                if depth == "series":
+                    n_instances = self.skip_array()
+                else:
+                    instances = []
+                    for _ in self.iter_array():
+                        instances.append(self.read_value())
+                    series[key] = instances
+                    n_instances = len(instances)
+            else:
+                series[key] = self.read_value()
+
+        return ("series", series, n_instances)
+
+def tree_events(tree, depth="instance", count_instances=len):
+    """
+    Yields the same events as iter_tree() for a tree already in memory.
+
+    Args:
+        tree: A dict with a 'StudyList'.
+        depth: See iter_tree().
+        count_instances: Gives the instance count from a series' 'InstanceList'.
+    """
+
+    header = {k: v for k, v in tree.items() if k != "StudyList"}
+    for study in tree["StudyList"]:
+        study_entries = {k: v for k, v in study.items() if k != "SeriesList"}
+        yield ("study", study_entries, None)
+        if depth != "study":
+            for series in study["SeriesList"]:
+                if depth == "series":
+                    series_entries = {k: v for k, v in series.items() if k != "InstanceList"}
+                else:
+                    series_entries = series
+                yield ("series", series_entries, count_instances(series["InstanceList"]))
+        yield ("end_study", study_entries, len(study["SeriesList"]))
+
+    yield ("end", header, len(tree["StudyList"]))
+
+# Instances of a series can be anywhere in an ndjson file, so below the
+# instance depth only the study and series entries and counts are kept
+def ndjson_events(f, depth="instance"):
+    if depth == "instance":
+        yield from tree_events(records_to_tree(read_ndjson_records(f)), depth)
+        return
+
+    tree = None
+    studies = {}
+    series_map = {}
+    for record in read_ndjson_records(f):
+        if tree is None:
+            tree = dict(record)
+            tree["StudyList"] = []
+            continue
+
+        study_uid = record["StudyInstanceUID"]
+        series_uid = record.get("SeriesInstanceUID")
+        if "Study" in record:
+            study = record["Study"]
+            study["SeriesList"] = []
+            tree["StudyList"].append(study)
+            studies[study_uid] = study
+        if "Series" in record:
+            series = record["Series"]
+            series["InstanceList"] = 0
+            studies[study_uid]["SeriesList"].append(series)
+            series_map[(study_uid, series_uid)] = series
+        if "Instance" in record:
+            series_map[(study_uid, series_uid)]["InstanceList"] += 1
+
+    if tree is None:
+        tree = {"StudyList": []}
+
+    # Each 'InstanceList' holds the instance count
+    yield from tree_events(tree, depth, count_instances=lambda n: n)
+
+def iter_tree(filename, depth="instance"):
+    """
+    Reads a tree file one study and series at a time.
+
+    Args:
+        filename: A tree file in any of the formats read by load_tree().
+        depth: 'study' to skip series lists, 'series' to skip instance lists, or 'instance' to read everything.
+
+    Yields:
+        (event, node, count) tuples, see the top of this file.
+    """
+
+    if depth not in DEPTHS:
+        raise ValueError("Unknown depth: %s" % depth)
+
+    if is_pickle(filename):
+        yield from tree_events(load_tree(filename), depth)
+        return
+
+    with open_tree_file(filename) as f:
+        if is_ndjson(filename):
+            yield from ndjson_events(f, depth)
+        else:
+            yield from JsonTreeReader(f).events(depth)
@@ -0,0 +1,170 @@
+import os
+import time
+import collections
+
+# inotify_simple is optional, without it the directory is polled
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+try:
+    from .archive_members import split_member
+except ImportError:
+    from archive_members import split_member
+
+def walk_dirs(path, depth=1):
+    """
+    Finds the directories in a directory tree, breadth first.
+
+    Yields:
+        (directory, level) with level 0 for path itself, down to depth levels (all levels if depth is negative).
+    """
+
+    visited = set()
+    queue = collections.deque([(path, 0)])
+    while queue:
+        dirname, level = queue.popleft()
+        try:
+            st = os.stat(dirname)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            with os.scandir(dirname) as entries:
+                subdirs = [entry.path for entry in entries if entry.is_dir()]
+        except OSError:
+            continue
+
+        yield (dirname, level)
+        if depth < 0 or level < depth:
+            queue.extend([(subdir, level+1) for subdir in subdirs])
+
+def walk_new_files(path, depth=1):
+    for dirname, level in walk_dirs(path, depth):
+        try:
+            with os.scandir(dirname) as entries:
+                files = [entry.path for entry in entries if entry.is_file()]
+        except OSError:
+            continue
+        yield from files
+
+def file_key(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+class FileWatcher:
+    """
+    Finds the files in a directory tree that are new or have changed since
+    they were read. With inotify a file is ready when it is closed after
+    writing or moved into the tree. When polling, a file is ready once its
+    size and mtime are the same on two polls in a row, so files that are
+    still being written are left for later.
+    """
+
+    def __init__(self, directory, depth=1, use_inotify=True):
+        self.directory = directory
+        self.depth = depth
+        self.read_keys = {}         # filename -> (size, mtime) when last read
+        self.pending = {}           # filename -> (size, mtime) on the last poll, not read yet
+
+        self.inotify = None
+        self.watch_dirs = {}        # inotify watch descriptor -> (directory, level)
+        if use_inotify and INotify is not None:
+            try:
+                self.inotify = INotify()
+                self.add_watches(directory, 0)
+            except OSError:
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+
+    @property
+    def mode(self):
+        return "poll" if self.inotify is None else "inotify"
+
+    def add_watches(self, path, level):
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.ONLYDIR
+        depth = self.depth-level if self.depth >= 0 else -1
+        for dirname, sublevel in walk_dirs(path, depth):
+            wd = self.inotify.add_watch(dirname, mask)
+            self.watch_dirs[wd] = (dirname, level+sublevel)
+
+    # Record files as read, e.g. by the first full scan. Archive members are recorded as their archive
+    def mark_read(self, files):
+        for f in files:
+            f = split_member(f)[0]
+            key = file_key(f)
+            if key is not None:
+                self.read_keys[f] = key
+            self.pending.pop(f, None)
+
+    def _ready(self, filename, key):
+        if key is None or self.read_keys.get(filename)==key:
+            return False
+        self.read_keys[filename] = key
+        self.pending.pop(filename, None)
+        return True
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for files to be ready.
+
+        Returns:
+            A list of the files that are ready to read, each is then counted as read.
+        """
+
+        if self.inotify is None:
+            time.sleep(timeout)
+            return self.poll()
+        return self.read_events(timeout)
+
+    def poll(self):
+        ready = []
+        seen = set()
+        for f in walk_new_files(self.directory, self.depth):
+            seen.add(f)
+            key = file_key(f)
+            if key is None or self.read_keys.get(f)==key:
+                continue
+            if self.pending.get(f)==key:
+                self._ready(f, key)
+                ready.append(f)
+            else:
+                self.pending[f] = key
+
+        # Forget files that were removed
+        for f in [f for f in self.pending if f not in seen]:
+            del self.pending[f]
+        return ready
+
+    def read_events(self, timeout):
+        ready = []
+        events = self.inotify.read(timeout=int(timeout*1000), read_delay=100)
+        for event in events:
+            # Events were lost, so look at every file
+            if event.mask & flags.Q_OVERFLOW:
+                return [f for f in walk_new_files(self.directory, self.depth) if self._ready(f, file_key(f))]
+
+            if event.wd not in self.watch_dirs or not event.name:
+                continue
+            dirname, level = self.watch_dirs[event.wd]
+            path = os.path.join(dirname, event.name)
+
+            # Files can land in a new directory before it is watched
+            if event.mask & flags.ISDIR:
+                if self.depth < 0 or level < self.depth:
+                    self.add_watches(path, level+1)
+                    depth = self.depth-level-1 if self.depth >= 0 else -1
+                    ready.extend([f for f in walk_new_files(path, depth) if self._ready(f, file_key(f))])
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                if self._ready(path, file_key(path)):
+                    ready.append(path)
+        return ready
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
@@ -19,5 +19,9 @@ setuptools.setup(
     },
     license='MIT',
     packages=['dicom_tree'],
-    install_requires=['pydicom']
+    install_requires=['pydicom'],
+    extras_require={
+        'orjson': ['orjson'],
+        'zstd': ['zstandard']
+    }
 )
\ No newline at end of file
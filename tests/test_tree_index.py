@@ -0,0 +1,32 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dicom_tree"))
+from tree_io import save_tree
+from tree_index import write_index, open_index, count_nodes, index_filename
+
+def entry(value):
+    return {"Group": "0008", "Element": "0018", "vr": "UI", "Value": [value]}
+
+TREE = {"Directory": "/data", "StudyList": [{"StudyInstanceUID": entry("1"), "SeriesList": [
+    {"SeriesInstanceUID": entry("1.1"), "InstanceList": [{"SOPInstanceUID": entry("1.1.%i" % i)} for i in range(3)]}]}]}
+
+# '?', '#' and '%' would end or escape the path in an sqlite URI
+def test_index_path_with_uri_characters(tmp_path):
+    directory = tmp_path / "a ?#%25 dir"
+    directory.mkdir()
+    tree_file = str(directory / "tree?#%.json")
+    save_tree(TREE, tree_file)
+    write_index(tree_file)
+
+    conn = open_index(tree_file)
+    assert conn is not None
+    assert count_nodes(conn, "instance") == 3
+    conn.close()
+
+def test_corrupt_index_is_ignored(tmp_path):
+    tree_file = str(tmp_path / "tree.json")
+    save_tree(TREE, tree_file)
+    with open(index_filename(tree_file), "w") as f:
+        f.write("not an sqlite file")
+    assert open_index(tree_file) is None
@@ -0,0 +1,66 @@
+import sys
+import os
+import subprocess
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = os.path.join(HERE, "..", "dicom_tree")
+
+sys.path.insert(0, TOOLS)
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+from tree_io import load_tree
+from dicom_corpus import make_corpus
+
+def run_tool(tool, args):
+    cmd = [sys.executable, os.path.join(TOOLS, tool)]+args
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# A -c scan keeps StudyDate in the study and in each instance. Pickle keeps
+# any object sharing in the tree, so date_shift must give the same tree
+# whether it was saved as pkl or json
+def test_date_shift_pickle_matches_json(tmp_path):
+    pytest.importorskip("prettytable")
+
+    corpus = str(tmp_path / "corpus")
+    make_corpus(corpus, n_studies=1, n_series=2, n_instances=3, rows=8)
+
+    shifted = []
+    for ext in (".pkl", ".json"):
+        tree_file = str(tmp_path / ("tree"+ext))
+        shift_file = str(tmp_path / ("shifted"+ext))
+        run_tool("dicom_tree.py", ["-p", corpus, "-r", "-1", "-c", "-o", tree_file])
+        run_tool("dicom_tree_date_shift.py", ["-i", tree_file, "-d", "-10", "-o", shift_file])
+        shifted.append(load_tree(shift_file))
+
+    pkl_tree, json_tree = shifted
+    assert pkl_tree == json_tree
+
+    study = pkl_tree['StudyList'][0]
+    instance = study['SeriesList'][0]['InstanceList'][0]
+    assert study['StudyDate'] == instance['StudyDate']
+
+# Instances resolved from a 'Common' block get their own copies of its
+# entries, so a tree expanded or merged to pkl is date shifted once
+@pytest.mark.parametrize("tool", ["dicom_tree_common.py", "dicom_tree_merge.py"])
+def test_date_shift_resolved_common_pickle(tmp_path, tool):
+    pytest.importorskip("prettytable")
+
+    corpus = str(tmp_path / "corpus")
+    make_corpus(corpus, n_studies=1, n_series=2, n_instances=3, rows=8)
+    hoisted = str(tmp_path / "hoisted.json")
+    run_tool("dicom_tree.py", ["-p", corpus, "-r", "-1", "-c", "--common", "-o", hoisted])
+
+    shifted = []
+    for ext in (".pkl", ".json"):
+        tree_file = str(tmp_path / ("tree"+ext))
+        shift_file = str(tmp_path / ("shifted"+ext))
+        if tool == "dicom_tree_common.py":
+            run_tool(tool, ["-t", hoisted, "-e", "-o", tree_file])
+        else:
+            run_tool(tool, ["-t", hoisted, "-o", tree_file])
+        run_tool("dicom_tree_date_shift.py", ["-i", tree_file, "-d", "10", "-o", shift_file])
+        shifted.append(load_tree(shift_file))
+
+    pkl_tree, json_tree = shifted
+    assert pkl_tree == json_tree
@@ -0,0 +1,35 @@
+import sys
+import os
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dicom_tree"))
+import tree_json
+
+TREE = {
+    "Directory": "/data",
+    "StudyList": [{
+        "StudyInstanceUID": {"Group": "0020", "Element": "000D", "vr": "UI", "Value": ["1.2.3"]},
+        "AccessionNumber": {"Group": "0008", "Element": "0050", "vr": "SH", "Value": None},
+        "SeriesList": [{"SliceThickness": {"Group": "0018", "Element": "0050", "vr": "DS", "Value": [2.5]}}]
+    }]
+}
+
+# Indented, compact and ndjson text is the same with or without orjson
+@pytest.mark.parametrize("compact", [False, True])
+def test_same_text_without_orjson(monkeypatch, compact):
+    if tree_json.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    texts = []
+    for orjson in (tree_json.orjson, None):
+        monkeypatch.setattr(tree_json, "orjson", orjson)
+        texts.append((tree_json.dumps(TREE, compact), tree_json.dumps_line(TREE)))
+    assert texts[0] == texts[1]
+
+def test_nan_and_infinity_are_kept():
+    obj = {"Value": [float("nan"), float("inf"), -float("inf"), None]}
+    values = json.loads(tree_json.dumps(obj))["Value"]
+    assert values[0] != values[0]
+    assert values[1:] == [float("inf"), -float("inf"), None]
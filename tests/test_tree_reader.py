@@ -0,0 +1,112 @@
+import sys
+import os
+import io
+import json
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dicom_tree"))
+import tree_reader
+from tree_reader import JsonTreeReader, iter_tree, tree_events, DEPTHS
+
+# Strings that end in backslashes or hold escaped quotes and brackets, which
+# the bracket scanner of JsonTreeReader.skip_array() must step over
+TRICKY = ['a"b', 'back\\', '\\\\', '\\"', '\\\\"', 'x\\\\\\"y', '"]}', '{[', '][}{', '\\"]', 'é ', '']
+
+def entry(value):
+    return {"Group": "0008", "Element": "0050", "vr": "SH", "Value": [value]}
+
+def make_instance(uid, text):
+    return {
+        "SOPInstanceUID": entry(uid),
+        "Note": entry(text),
+        "Seq": {"vr": "SQ", "Value": [{"00080100": {"vr": "SH", "Value": [text, "[{"]}}]},
+        "Empty": {"vr": "SH", "Value": []},
+        "Number": {"vr": "DS", "Value": [1.5e-7, -3, 10]}
+    }
+
+def make_tree():
+    studies = []
+    for s in range(3):
+        series_list = []
+        for r in range(3):
+            instances = [make_instance("%i.%i.%i" % (s, r, i), TRICKY[(s+r+i) % len(TRICKY)]) for i in range(4)]
+            series_list.append({"SeriesInstanceUID": entry("%i.%i" % (s, r)), "Text": entry(TRICKY[r]),
+                "InstanceList": instances if r < 2 else []})
+        studies.append({"StudyInstanceUID": entry(str(s)), "Text": entry(TRICKY[s]),
+            "SeriesList": series_list if s < 2 else []})
+    return {"Directory": "/data/\"quoted\"\\dir", "StudyList": studies}
+
+# Random strings of quotes, backslashes and brackets, seeded so failures repeat
+def make_random_tree(seed):
+    rng = random.Random(seed)
+    def text():
+        return "".join(rng.choice('"\\[]{},: ab') for _ in range(rng.randrange(12)))
+
+    studies = []
+    for s in range(4):
+        series_list = []
+        for r in range(rng.randrange(4)):
+            instances = [make_instance(str(i), text()) for i in range(rng.randrange(6))]
+            series_list.append({"SeriesInstanceUID": entry(text()), "InstanceList": instances})
+        studies.append({"StudyInstanceUID": entry(text()), "SeriesList": series_list})
+    return {"Directory": text(), "StudyList": studies}
+
+def expected_events(tree, depth):
+    return list(tree_events(tree, depth))
+
+def read_events(text, depth, chunk_size):
+    return list(JsonTreeReader(io.StringIO(text), chunk_size=chunk_size).events(depth))
+
+def dump_texts(tree):
+    return [json.dumps(tree), json.dumps(tree, indent=2), json.dumps(tree, separators=(',', ':'), ensure_ascii=False)]
+
+@pytest.mark.parametrize("depth", DEPTHS)
+def test_iter_tree_matches_json_load(tmp_path, depth):
+    tree = make_tree()
+    for i, text in enumerate(dump_texts(tree)):
+        filename = str(tmp_path / ("tree%i.json" % i))
+        with open(filename, "w") as f:
+            f.write(text)
+        with open(filename) as f:
+            loaded = json.load(f)
+        assert list(iter_tree(filename, depth)) == expected_events(loaded, depth)
+
+# Chunks and skip windows of a few characters put every string, escape and
+# bracket across a refill or window boundary somewhere in the file
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+@pytest.mark.parametrize("window", [1, 2, 5, 16])
+def test_small_chunks_and_windows(monkeypatch, chunk_size, window):
+    monkeypatch.setattr(tree_reader, "_SKIP_WINDOW", window)
+    tree = make_tree()
+    for text in dump_texts(tree):
+        for depth in DEPTHS:
+            assert read_events(text, depth, chunk_size) == expected_events(json.loads(text), depth)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_strings(monkeypatch, seed):
+    monkeypatch.setattr(tree_reader, "_SKIP_WINDOW", 8)
+    tree = make_random_tree(seed)
+    for text in dump_texts(tree):
+        for depth in DEPTHS:
+            assert read_events(text, depth, 5) == expected_events(json.loads(text), depth)
+
+def test_skip_array_counts():
+    for text in ['[]', '[ ]', '[{}]', '[{"a": "]"}, {"b": ["{", {}]}]', '[{"a": "\\\\"}, {"b": "\\""}]']:
+        reader = JsonTreeReader(io.StringIO(text+' "rest"'), chunk_size=2)
+        assert reader.skip_array() == len(json.loads(text))
+        assert reader.read_value() == "rest"
+
+def test_empty_study_list():
+    for text in ['{"Directory": "/d", "StudyList": []}', '{"StudyList":[]}']:
+        for depth in DEPTHS:
+            assert read_events(text, depth, 3) == expected_events(json.loads(text), depth)
+
+def test_brackets_and_partial_strings():
+    assert tree_reader._brackets('{"a": "[x]"}') == ("{}", 12)
+    assert tree_reader._brackets('{"a": "\\"]"}') == ("{}", 12)
+    # A string that runs past the end of the text is left for the next window
+    assert tree_reader._brackets('[{"a": "x\\"y') == ("[{", 7)
+    assert tree_reader._brackets('[{"a": "x') == ("[{", 7)
+    assert tree_reader._partial_string_start('"a" "b\\\\" "c\\"') == 10